@@ -0,0 +1,4 @@
+"""Provides benchmarks for the Social Insecurity application.
+
+Each benchmark is a module that can be run with 'poetry run python -m benchmarks.<name>'.
+"""
@@ -0,0 +1,96 @@
+"""Counts the commits each kind of request makes against the database.
+
+Every commit is a point where a request waits for the disk: with a rollback journal or synchronous=FULL it is
+an fsync, and in WAL mode with synchronous=NORMAL it appends to the WAL that the next checkpoint fsyncs.
+A request that groups its writes into one transaction makes one commit, and a request that only reads makes none.
+
+Usage:
+    poetry run python -m benchmarks.bench_commits [--requests N]
+
+Prints one JSON object per kind of request, with the commits and statements per request.
+"""
+
+import argparse
+import json
+import re
+import tempfile
+
+from flask import g
+
+from benchmarks.common import create_benchmark_app, login, register
+from social_insecurity import sqlite
+
+WRITE_KEYWORDS = {"INSERT", "UPDATE", "DELETE", "REPLACE"}
+
+
+class CommitCounter:
+    """Counts commits and statements from the SQLite trace callback of a connection."""
+
+    def __init__(self) -> None:
+        self.commits = 0
+        self.statements = 0
+        self._in_transaction = False
+
+    def __call__(self, statement: str) -> None:
+        keyword = statement.split(None, 1)[0].upper().rstrip(";") if statement.strip() else ""
+        self.statements += 1
+        if keyword == "BEGIN":
+            self._in_transaction = True
+        elif keyword in ("COMMIT", "END"):
+            self._in_transaction = False
+            self.commits += 1
+        elif keyword == "ROLLBACK":
+            self._in_transaction = False
+        elif keyword in WRITE_KEYWORDS and not self._in_transaction:
+            self.commits += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50, help="Number of requests of each kind")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(directory)
+        counter = CommitCounter()
+
+        @app.before_request
+        def trace_connection() -> None:
+            sqlite.connection.set_trace_callback(counter)
+
+        @app.teardown_request
+        def untrace_connection(exception) -> None:
+            if "flask_sqlite3_connection" in g:
+                sqlite.connection.set_trace_callback(None)
+
+        client = app.test_client()
+        register(client, "alice")
+        register(client, "bob")
+        login(client, "alice")
+        client.post("/friends", data={"username": "bob"})
+        client.post("/stream", data={"content": "First post"})
+        post_id = re.search(r"/comments/(\d+)", client.get("/stream").get_data(as_text=True)).group(1)
+
+        scenarios = {
+            "GET /stream": lambda: client.get("/stream"),
+            "POST /stream": lambda: client.post("/stream", data={"content": "Benchmark post"}),
+            "GET /comments": lambda: client.get(f"/comments/{post_id}"),
+            "POST /comments": lambda: client.post(f"/comments/{post_id}", data={"comment": "Benchmark comment"}),
+            "GET /friends": lambda: client.get("/friends"),
+            "POST /profile": lambda: client.post("/profile", data={"education": "Benchmark"}),
+        }
+        for name, request in scenarios.items():
+            counter.commits = counter.statements = 0
+            for _ in range(args.requests):
+                request()
+            result = {
+                "request": name,
+                "requests": args.requests,
+                "commits_per_request": counter.commits / args.requests,
+                "statements_per_request": counter.statements / args.requests,
+            }
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
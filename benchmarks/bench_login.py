@@ -0,0 +1,77 @@
+"""Measures login throughput through the index page.
+
+Several client threads log the same user in and out as fast as they can, while the password hashes are checked
+by the password hasher's worker processes. Run it with '--workers 0' to check hashes on the request threads
+instead, which is how logins were served before the hasher existed.
+
+Usage:
+    poetry run python -m benchmarks.bench_login [--workers N] [--threads N] [--logins N] [--rounds N]
+
+Prints a JSON object with the logins per second, the logins per second per core and the latency percentiles.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+
+from benchmarks.common import create_benchmark_app, login, register
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Password hasher worker processes")
+    parser.add_argument("--threads", type=int, default=2 * (os.cpu_count() or 1), help="Concurrent clients")
+    parser.add_argument("--logins", type=int, default=100, help="Total number of logins")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(
+            directory,
+            BCRYPT_LOG_ROUNDS=args.rounds,
+            PASSWORD_HASHER_WORKERS=args.workers,
+            PASSWORD_HASHER_MAX_PENDING=args.threads,
+            PASSWORD_HASHER_TIMEOUT=60,
+        )
+        register(app.test_client(), "alice")
+
+        def run_client(logins: int) -> list[float]:
+            client = app.test_client()
+            latencies = []
+            for _ in range(logins):
+                start = time.perf_counter()
+                if not login(client, "alice"):
+                    raise RuntimeError("Login failed")
+                latencies.append(time.perf_counter() - start)
+                client.get("/logout")
+            return latencies
+
+        shares = [args.logins // args.threads + (i < args.logins % args.threads) for i in range(args.threads)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as clients:
+            latencies = [latency for result in clients.map(run_client, shares) for latency in result]
+        elapsed = time.perf_counter() - start
+
+        app.extensions["password_hasher"].shutdown()
+
+    cores = min(args.workers or 1, os.cpu_count() or 1)
+    percentiles = quantiles(latencies, n=100)
+    result = {
+        "workers": args.workers,
+        "threads": args.threads,
+        "rounds": args.rounds,
+        "logins": len(latencies),
+        "logins_per_second": len(latencies) / elapsed,
+        "logins_per_second_per_core": len(latencies) / elapsed / cores,
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+    }
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
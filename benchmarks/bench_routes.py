@@ -0,0 +1,269 @@
+"""Measures the latency, throughput and queries per request of the main routes.
+
+The database is seeded with a synthetic data set (see benchmarks.dataset), and every scenario is requested by
+the most connected user, whose timeline is the largest. The routes are driven through the Flask test client,
+which measures the application alone, and through a threaded WSGI server on a local port, which adds HTTP
+parsing, sockets and contention between concurrent clients. Queries are counted from the SQLite trace callback
+of the request's connection, without the statements that begin and end transactions.
+
+Usage:
+    poetry run python -m benchmarks.bench_routes [--server test-client|wsgi|both] [--requests N] [--threads N]
+        [--baseline FILE] [--users N] [--friends N] [--posts N] [--comments N]
+
+Prints one JSON object per server and scenario, with the commit it was run on. Save the output of one commit
+and pass it as --baseline on another to add the relative change of each figure.
+"""
+
+import argparse
+import http.client
+import json
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from typing import NamedTuple, Optional, Union
+from urllib.parse import urlencode
+
+from flask import Flask, g
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.common import PASSWORD, create_benchmark_app
+from benchmarks.dataset import Dataset, add_arguments, seed_from_arguments
+from social_insecurity import sqlite
+
+TRANSACTION_KEYWORDS = {"BEGIN", "COMMIT", "END", "ROLLBACK", "SAVEPOINT", "RELEASE"}
+
+
+class Scenario(NamedTuple):
+    """Describes a request to repeat. Anonymous requests are sent without the session cookie."""
+
+    name: str
+    method: str
+    path: str
+    data: Optional[dict] = None
+    anonymous: bool = False
+
+
+class QueryCounter:
+    """Counts the queries of all requests from the SQLite trace callback of their connections."""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def install(self, app: Flask) -> None:
+        """Traces the connection of every request of the app."""
+
+        @app.before_request
+        def trace_connection() -> None:
+            self._local.last = None
+            sqlite.connection.set_trace_callback(self._count)
+
+        @app.teardown_request
+        def untrace_connection(exception) -> None:
+            if "flask_sqlite3_connection" in g:
+                sqlite.connection.set_trace_callback(None)
+
+    def reset(self) -> int:
+        """Returns the number of queries counted since the last reset."""
+        with self._lock:
+            queries, self.queries = self.queries, 0
+        return queries
+
+    def _count(self, statement: str) -> None:
+        # Statements run by triggers and FTS5 are reported too, and the statement itself once more per trigger
+        if statement.startswith("--") or "'main'." in statement or statement == getattr(self._local, "last", None):
+            return
+        self._local.last = statement
+        keyword = statement.split(None, 1)[0].upper().rstrip(";") if statement.strip() else ""
+        if keyword not in TRANSACTION_KEYWORDS:
+            with self._lock:
+                self.queries += 1
+
+
+class TestClientSession:
+    """Sends requests through the Flask test client, logged in as one user."""
+
+    def __init__(self, app: Flask, username: str) -> None:
+        self._app = app
+        self._client = app.test_client()
+        self.request("POST", "/", login_form(username))
+
+    def request(
+        self, method: str, path: str, data: Optional[dict] = None, anonymous: bool = False
+    ) -> tuple[int, bytes]:
+        """Sends a request and returns the status code and the body of the response."""
+        client = self._app.test_client() if anonymous else self._client
+        response = client.open(path, method=method, data=data)
+        return response.status_code, response.get_data()
+
+
+class HTTPSession:
+    """Sends requests over one keep-alive HTTP connection, logged in as one user."""
+
+    def __init__(self, port: int, username: str) -> None:
+        self._port = port
+        self._connection = http.client.HTTPConnection("127.0.0.1", port)
+        self._cookies: dict[str, str] = {}
+        self.request("POST", "/", login_form(username))
+
+    def request(
+        self, method: str, path: str, data: Optional[dict] = None, anonymous: bool = False
+    ) -> tuple[int, bytes]:
+        """Sends a request and returns the status code and the body of the response."""
+        connection = http.client.HTTPConnection("127.0.0.1", self._port) if anonymous else self._connection
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self._cookies and not anonymous:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in self._cookies.items())
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        content = response.read()
+        if not anonymous:
+            for header in response.headers.get_all("Set-Cookie") or []:
+                name, _, value = header.split(";", 1)[0].partition("=")
+                self._cookies[name.strip()] = value
+        else:
+            connection.close()
+        return response.status, content
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """Keeps connections open between requests, like the WSGI servers the application is deployed with."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args, **kwargs) -> None:
+        pass
+
+
+Session = Union[TestClientSession, HTTPSession]
+
+
+def login_form(username: str) -> dict:
+    """Returns the form data that logs the user in through the index page."""
+    return {"login-username": username, "login-password": PASSWORD, "login-submit": "Sign In"}
+
+
+def scenarios(session: Session, dataset: Dataset) -> list[Scenario]:
+    """Returns the scenarios, reading the cursor of the second stream page first."""
+    status, content = session.request("GET", "/api/stream")
+    cursor = json.loads(content)["next_cursor"] if status == 200 else ""
+    post = dataset.popular_post
+    return [
+        Scenario("GET /stream", "GET", "/stream"),
+        Scenario("GET /stream/more", "GET", f"/stream/more?cursor={cursor}"),
+        Scenario("GET /api/stream", "GET", "/api/stream"),
+        Scenario("POST /stream", "POST", "/stream", {"content": "Benchmark post"}),
+        Scenario("GET /comments", "GET", f"/comments/{post}"),
+        Scenario("POST /comments", "POST", f"/comments/{post}", {"comment": "Benchmark comment"}),
+        Scenario("GET /friends", "GET", "/friends"),
+        Scenario("POST /friends", "POST", "/friends", {"username": dataset.typical}),
+        Scenario("GET /search", "GET", "/search?q=cache+late"),
+        Scenario("POST / (login)", "POST", "/", login_form(dataset.hub), anonymous=True),
+    ]
+
+
+def run(scenario: Scenario, sessions: list[Session], requests: int) -> tuple[list[float], int, float]:
+    """Sends the scenario's request from every session in parallel.
+
+    returns: The latency of every request, the number of failed requests and the elapsed time.
+
+    """
+
+    def run_session(session: Session, count: int) -> tuple[list[float], int]:
+        latencies, errors = [], 0
+        for _ in range(count):
+            start = time.perf_counter()
+            status, _ = session.request(scenario.method, scenario.path, scenario.data, scenario.anonymous)
+            latencies.append(time.perf_counter() - start)
+            errors += status >= 400
+        return latencies, errors
+
+    shares = [requests // len(sessions) + (i < requests % len(sessions)) for i in range(len(sessions))]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(sessions)) as pool:
+        results = list(pool.map(run_session, sessions, shares))
+    elapsed = time.perf_counter() - start
+    return [latency for latencies, _ in results for latency in latencies], sum(e for _, e in results), elapsed
+
+
+def current_commit() -> Optional[str]:
+    """Returns the commit the benchmark runs on, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(result: dict, baseline: dict) -> None:
+    """Adds the relative change of each figure to the result, e.g. 0.1 for 10% more than in the baseline."""
+    for key in ("p50_ms", "p99_ms", "requests_per_second", "queries_per_request"):
+        if baseline.get(key):
+            result[f"{key}_change"] = round(result[key] / baseline[key] - 1, 3)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=["test-client", "wsgi", "both"], default="both", help="How to send")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent clients of the WSGI server")
+    parser.add_argument("--rounds", type=int, default=4, help="bcrypt cost factor, see bench_login for logins")
+    parser.add_argument("--baseline", help="JSON lines printed by an earlier run, to compare against")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            for line in file:
+                baseline = json.loads(line)
+                baselines[baseline["server"], baseline["request"]] = baseline
+
+    commit = current_commit()
+    servers = ["test-client", "wsgi"] if args.server == "both" else [args.server]
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(directory, BCRYPT_LOG_ROUNDS=args.rounds, PASSWORD_HASHER_WORKERS=0)
+        dataset = seed_from_arguments(app, args)
+        counter = QueryCounter()
+        counter.install(app)
+        server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=KeepAliveRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        for name in servers:
+            if name == "test-client":
+                sessions = [TestClientSession(app, dataset.hub)]
+            else:
+                sessions = [HTTPSession(server.server_port, dataset.hub) for _ in range(args.threads)]
+            for scenario in scenarios(sessions[0], dataset):
+                run(scenario, sessions, len(sessions))  # Warm up the caches and connections
+                counter.reset()
+                latencies, errors, elapsed = run(scenario, sessions, args.requests)
+                percentiles = quantiles(latencies, n=100)
+                result = {
+                    "commit": commit,
+                    "server": name,
+                    "request": scenario.name,
+                    "requests": len(latencies),
+                    "threads": len(sessions),
+                    "errors": errors,
+                    "requests_per_second": round(len(latencies) / elapsed, 1),
+                    "p50_ms": round(percentiles[49] * 1000, 3),
+                    "p99_ms": round(percentiles[98] * 1000, 3),
+                    "queries_per_request": counter.reset() / len(latencies),
+                    "dataset": dataset._asdict(),
+                }
+                if (name, scenario.name) in baselines:
+                    compare(result, baselines[name, scenario.name])
+                print(json.dumps(result), flush=True)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
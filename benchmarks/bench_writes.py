@@ -0,0 +1,123 @@
+"""Compares the inserts per second of posting comments with and without the write queue.
+
+Several worker processes, each with several client threads, post comments through the test client at the same
+time, like the workers of a WSGI server under a burst of traffic. Without the write queue every comment is a
+transaction of its own, and the workers wait for each other's write lock. With it, each worker's writer thread
+commits the comments waiting in that worker together.
+
+Usage:
+    poetry run python -m benchmarks.bench_writes [--processes N] [--threads N] [--writes N] [--max-delay MS]
+
+Prints one JSON object per mode, with the writes per second, the latency percentiles and the batch sizes.
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+from multiprocessing.synchronize import Barrier
+from statistics import quantiles
+from threading import Thread
+from typing import Any
+
+from benchmarks.common import create_benchmark_app, login, register
+from social_insecurity import write_queue
+from social_insecurity.hashing import worker_context
+
+
+def app_config(enabled: bool, max_delay: float) -> dict[str, Any]:
+    """Returns the settings of the benchmark app in every process."""
+    return {
+        "WRITE_QUEUE_ENABLED": enabled,
+        "WRITE_QUEUE_MAX_DELAY": max_delay,
+        "BCRYPT_LOG_ROUNDS": 4,
+        "PASSWORD_HASHER_WORKERS": 0,
+    }
+
+
+def run_worker(
+    directory: str, config: dict[str, Any], post_id: str, threads: int, writes: int, start: Barrier, results: Any
+) -> None:
+    """Posts comments from several threads once every worker is ready, and puts the latencies in the results."""
+    app = create_benchmark_app(directory, **config)
+    latencies: list[float] = []
+    errors = 0
+
+    def run_client() -> None:
+        nonlocal errors
+        client = app.test_client()
+        login(client, "alice")
+        start.wait()
+        for _ in range(writes):
+            began = time.perf_counter()
+            response = client.post(f"/comments/{post_id}", data={"comment": "Benchmark comment"})
+            latencies.append(time.perf_counter() - began)
+            errors += response.status_code >= 400
+
+    clients = [Thread(target=run_client) for _ in range(threads)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    results.put((latencies, errors, write_queue.stats))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="Client threads per worker process")
+    parser.add_argument("--writes", type=int, default=100, help="Comments posted by each client thread")
+    parser.add_argument("--max-delay", type=float, default=2, help="WRITE_QUEUE_MAX_DELAY in milliseconds")
+    args = parser.parse_args()
+
+    context = worker_context()
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(directory, **app_config(False, args.max_delay))
+        client = app.test_client()
+        register(client, "alice")
+        login(client, "alice")
+        client.post("/stream", data={"content": "First post"})
+        post_id = re.search(r"/comments/(\d+)", client.get("/stream").get_data(as_text=True)).group(1)
+
+        for mode, enabled in (("direct", False), ("group-commit", True)):
+            start = context.Barrier(args.processes * args.threads + 1)
+            results = context.Queue()
+            config = app_config(enabled, args.max_delay)
+            workers = [
+                context.Process(
+                    target=run_worker,
+                    args=(directory, config, post_id, args.threads, args.writes, start, results),
+                )
+                for _ in range(args.processes)
+            ]
+            for worker in workers:
+                worker.start()
+            start.wait()
+            began = time.perf_counter()
+            outcomes = [results.get() for _ in workers]
+            elapsed = time.perf_counter() - began
+            for worker in workers:
+                worker.join()
+
+            latencies = [latency for outcome in outcomes for latency in outcome[0]]
+            batches = sum(outcome[2]["batches"] for outcome in outcomes)
+            percentiles = quantiles(latencies, n=100)
+            result = {
+                "mode": mode,
+                "processes": args.processes,
+                "threads": args.threads,
+                "writes": len(latencies),
+                "errors": sum(outcome[1] for outcome in outcomes),
+                "writes_per_second": round(len(latencies) / elapsed, 1),
+                "p50_ms": round(percentiles[49] * 1000, 3),
+                "p99_ms": round(percentiles[98] * 1000, 3),
+                "batches": batches,
+                "mean_batch_size": round(len(latencies) / batches, 2) if batches else None,
+            }
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Provides helpers shared by the benchmarks.
+
+The benchmarks run the real application factory against a database in a temporary directory,
+so they never touch the instance folder.
+"""
+
+import os
+from pathlib import Path
+from typing import Any
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from flask import Flask  # noqa: E402
+from flask.testing import FlaskClient  # noqa: E402
+
+from social_insecurity import create_app  # noqa: E402
+
+PASSWORD = "Benchmark1!"
+
+
+def create_benchmark_app(directory: str, **config: Any) -> Flask:
+    """Creates the application with its database and uploads in the directory and CSRF and rate limits disabled."""
+
+    class BenchmarkConfig:
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        RATELIMIT_ENABLED = False
+        SQLITE3_DATABASE_PATH = str(Path(directory) / "sqlite3.db")
+        UPLOADS_FOLDER_PATH = str(Path(directory) / "uploads")
+
+    for key, value in config.items():
+        setattr(BenchmarkConfig, key, value)
+    return create_app(BenchmarkConfig)
+
+
+def register(client: FlaskClient, username: str, password: str = PASSWORD) -> None:
+    """Registers a user through the index page."""
+    client.post(
+        "/",
+        data={
+            "register-first_name": username,
+            "register-last_name": "Benchmark",
+            "register-username": username,
+            "register-password": password,
+            "register-confirm_password": password,
+            "register-submit": "Sign Up",
+        },
+    )
+
+
+def login(client: FlaskClient, username: str, password: str = PASSWORD) -> bool:
+    """Logs a user in through the index page and returns whether it succeeded."""
+    data = {"login-username": username, "login-password": password, "login-submit": "Sign In"}
+    return client.post("/", data=data).status_code == 302
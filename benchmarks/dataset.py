@@ -0,0 +1,238 @@
+"""Generates a synthetic data set for the benchmarks.
+
+The friend graph is grown by preferential attachment: every new user adds a few friends, picked with a
+probability proportional to the number of friendships they already have. This gives the power-law degree
+distribution of real social networks, with a few hubs whose timelines hold a large share of all posts. Active
+users post more, and popular posts get more comments, so both are skewed the same way.
+
+The rows are written with executemany in one transaction, and the derived tables (Feeds, FeedVersions, comment
+counts) are rebuilt afterwards with the same functions as the CLI commands. Every user has the password
+common.PASSWORD. The same seed always gives the same data set.
+
+Usage:
+    poetry run python -m benchmarks.dataset DIRECTORY [--users N] [--friends N] [--posts N] [--comments N]
+
+Seeds the database in DIRECTORY, e.g. to run the application against it with a WSGI server of your choice, and
+prints a JSON object describing the data set.
+"""
+
+import argparse
+import io
+import json
+import random
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+from benchmarks.common import PASSWORD, create_benchmark_app
+from social_insecurity import friend_graph, passwords, sqlite, upload_store
+from social_insecurity.feed import rebuild_feeds, reconcile_comment_counts
+
+FIRST_NAMES = ["Ada", "Alan", "Barbara", "Edsger", "Grace", "John", "Ken", "Margaret", "Niklaus", "Radia"]
+LAST_NAMES = ["Hopper", "Kernighan", "Knuth", "Lamport", "Liskov", "Lovelace", "Perlman", "Ritchie", "Turing"]
+WORDS = "cache latency index query page stream friend photo coffee deploy weekend release bug fix review".split()
+
+
+class Dataset(NamedTuple):
+    """Describes a generated data set, and the users and posts the benchmarks request."""
+
+    users: int
+    friendships: int
+    posts: int
+    comments: int
+    images: int
+    hub: str  # The user with the most friendships, whose timeline is the largest
+    typical: str  # A user with the median number of friendships
+    popular_post: int  # The post with the most comments, on the hub's timeline
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    """Returns a sentence of random words, so that the search index has terms to match."""
+    return " ".join(rng.choices(WORDS, k=words)).capitalize()
+
+
+def png(rng: random.Random) -> bytes:
+    """Returns a small PNG of a random colour, or an empty byte string if Pillow is not installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b""
+    buffer = io.BytesIO()
+    colour = tuple(rng.randrange(256) for _ in range(3))
+    Image.new("RGB", (rng.randint(64, 640), rng.randint(64, 480)), colour).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def friend_graph_edges(rng: random.Random, users: int, friends: int) -> list[tuple[int, int]]:
+    """Grows a friend graph by preferential attachment.
+
+    params:
+        rng: The random number generator.
+        users: The number of users, with ids 1 to users.
+        friends: The number of friends each new user adds.
+
+    returns: The (u_id, f_id) pairs, without duplicates or self-friendships.
+
+    """
+    edges: list[tuple[int, int]] = []
+    # Every user appears once per friendship, plus once so that users without friends can be picked
+    endpoints: list[int] = []
+    for user_id in range(1, users + 1):
+        chosen: set[int] = set()
+        while endpoints and len(chosen) < min(friends, user_id - 1):
+            chosen.add(rng.choice(endpoints))
+        for friend_id in sorted(chosen):
+            edges.append((user_id, friend_id))
+            endpoints += (user_id, friend_id)
+        endpoints.append(user_id)
+    return edges
+
+
+def seed(
+    app: Flask,
+    users: int = 1000,
+    friends: int = 3,
+    posts: int = 10,
+    comments: int = 3,
+    images: int = 20,
+    image_ratio: float = 0.1,
+    random_seed: int = 0,
+) -> Dataset:
+    """Fills the application's database with a synthetic data set.
+
+    params:
+        app: The application, created by create_benchmark_app.
+        users (optional): The number of users.
+        friends (optional): The number of friends each new user adds, the mean degree is twice as large.
+        posts (optional): The mean number of posts per user.
+        comments (optional): The mean number of comments per post.
+        images (optional): The number of distinct images, shared by the posts with an image.
+        image_ratio (optional): The share of posts with an image.
+        random_seed (optional): The seed of the random number generator.
+
+    returns: The description of the data set.
+
+    """
+    rng = random.Random(random_seed)
+    start = datetime(2024, 1, 1)
+
+    with app.app_context():
+        pw_hash = passwords.hash(PASSWORD)
+        edges = friend_graph_edges(rng, users, friends)
+        degree = [1] * (users + 1)
+        for user_id, friend_id in edges:
+            degree[user_id] += 1
+            degree[friend_id] += 1
+
+        user_ids = list(range(1, users + 1))
+        authors = rng.choices(user_ids, weights=degree[1:], k=users * posts)
+        post_times = sorted(start + timedelta(seconds=rng.randrange(30 * 86400)) for _ in authors)
+        popularity = [rng.paretovariate(1.2) for _ in authors]
+        commented = rng.choices(range(1, len(authors) + 1), weights=popularity, k=len(authors) * comments)
+
+        stored = []
+        for _ in range(images):
+            content = png(rng)
+            if content:
+                stored.append(upload_store.save(FileStorage(io.BytesIO(content)), "png"))
+        stored = [upload for upload in stored if upload is not None]
+        post_images = [
+            rng.choice(stored).filename if stored and rng.random() < image_ratio else None for _ in authors
+        ]
+
+        with sqlite.transaction() as db:
+            db.execute("DELETE FROM Comments;")
+            db.execute("DELETE FROM Friends;")
+            db.execute("DELETE FROM Posts;")
+            db.execute("DELETE FROM Users;")
+            db.executemany(
+                "INSERT INTO Users (id, username, first_name, last_name, password) VALUES (?, ?, ?, ?, ?);",
+                (
+                    (user_id, f"user{user_id}", rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), pw_hash)
+                    for user_id in user_ids
+                ),
+            )
+            db.executemany("INSERT INTO Friends (u_id, f_id) VALUES (?, ?);", edges)
+            db.executemany(
+                "INSERT INTO Posts (id, u_id, content, image, creation_time) VALUES (?, ?, ?, ?, ?);",
+                (
+                    (post_id, author, sentence(rng, 8), image, str(time))
+                    for post_id, (author, image, time) in enumerate(zip(authors, post_images, post_times), 1)
+                ),
+            )
+            db.executemany(
+                "INSERT INTO Comments (p_id, u_id, comment, creation_time) VALUES (?, ?, ?, ?);",
+                (
+                    (post_id, rng.choice(user_ids), sentence(rng, 5), str(post_times[post_id - 1] + timedelta(hours=1)))
+                    for post_id in commented
+                ),
+            )
+            uses: dict[str, int] = {}
+            for image in filter(None, post_images):
+                uses[image] = uses.get(image, 0) + 1
+            db.executemany(
+                "UPDATE Uploads SET refcount = ? WHERE digest = ?;",
+                ((uses.get(upload.filename, 0), upload.digest) for upload in stored),
+            )
+            rebuild_feeds(db)
+            reconcile_comment_counts(db)
+
+        friend_graph.reload()
+        hub = max(user_ids, key=lambda user_id: degree[user_id])
+        typical = sorted(user_ids, key=lambda user_id: degree[user_id])[users // 2]
+        get_popular = """
+            SELECT p.id FROM Feeds AS f JOIN Posts AS p ON p.id = f.p_id
+            WHERE f.u_id = ? ORDER BY p.comment_count DESC LIMIT 1;
+        """
+        popular_post = sqlite.read(get_popular, hub, one=True)
+
+    return Dataset(
+        users=users,
+        friendships=len(edges),
+        posts=len(authors),
+        comments=len(commented),
+        images=len(stored),
+        hub=f"user{hub}",
+        typical=f"user{typical}",
+        popular_post=popular_post["id"] if popular_post else 0,
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the options of seed() to a command line parser."""
+    parser.add_argument("--users", type=int, default=1000, help="Number of users")
+    parser.add_argument("--friends", type=int, default=3, help="Friends added by each new user")
+    parser.add_argument("--posts", type=int, default=10, help="Mean posts per user")
+    parser.add_argument("--comments", type=int, default=3, help="Mean comments per post")
+    parser.add_argument("--images", type=int, default=20, help="Distinct images")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator")
+
+
+def seed_from_arguments(app: Flask, args: argparse.Namespace) -> Dataset:
+    """Calls seed() with the options added by add_arguments()."""
+    return seed(
+        app,
+        users=args.users,
+        friends=args.friends,
+        posts=args.posts,
+        comments=args.comments,
+        images=args.images,
+        random_seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="Directory of the database and uploads")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor of the passwords")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    app = create_benchmark_app(args.directory, BCRYPT_LOG_ROUNDS=args.rounds, PASSWORD_HASHER_WORKERS=0)
+    print(json.dumps(seed_from_arguments(app, args)._asdict()))
+
+
+if __name__ == "__main__":
+    main()
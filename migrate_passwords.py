@@ -1,25 +1,87 @@
-from social_insecurity import bcrypt, create_app, sqlite
+"""Hashes the plaintext passwords left in the Users table with bcrypt.
 
+Users are read in batches ordered by id, the passwords of a batch are hashed in parallel by a pool of worker
+processes, and each batch is written in a single transaction. After every batch the last id is saved to a
+checkpoint file, so an interrupted migration resumes where it stopped when it is run again.
 
-def migrate_passwords():
-    app = create_app()
-    with app.app_context():
-        users = sqlite.connection.execute("SELECT id, password FROM Users").fetchall()
-        print(users)
-
-        for user in users:
-            user_id, password = user["id"], user["password"]
-            if not password.startswith("$2b$"):
-                hashed_password = bcrypt.generate_password_hash(password).decode("utf-8")
-
-                q = """UPDATE Users SET password = ? WHERE id = ?"""
-                sqlite.query(
-                    q,
-                    hashed_password, 
-                    user_id
+Usage:
+    poetry run python migrate_passwords.py [--batch-size N] [--workers N] [--checkpoint PATH] [--restart]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+
+from flask import current_app
+
+from social_insecurity import create_app, sqlite
+from social_insecurity.hashing import hash_password, hash_rounds, worker_context
+
+
+def read_checkpoint(checkpoint: Path) -> int:
+    """Returns the last migrated user id saved in the checkpoint file, or 0 if there is none."""
+    try:
+        return int(checkpoint.read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def write_checkpoint(checkpoint: Path, last_id: int) -> None:
+    """Saves the last migrated user id, replacing the checkpoint file atomically."""
+    partial = checkpoint.with_suffix(".tmp")
+    partial.write_text(str(last_id))
+    os.replace(partial, checkpoint)
+
+
+def migrate_passwords(batch_size: int, workers: int, checkpoint: Path, restart: bool = False) -> None:
+    if restart:
+        checkpoint.unlink(missing_ok=True)
+    last_id = read_checkpoint(checkpoint)
+    if last_id:
+        print(f"Resuming after user id {last_id}.")
+
+    rounds = current_app.config["BCRYPT_LOG_ROUNDS"]
+    get_users = "SELECT id, password FROM Users WHERE id > ? ORDER BY id LIMIT ?;"
+    update_password = "UPDATE Users SET password = ? WHERE id = ? AND password = ?;"
+    scanned = migrated = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(workers, mp_context=worker_context()) as pool:
+        while users := sqlite.read(get_users, last_id, batch_size):
+            plaintext = [user for user in users if user["password"] and hash_rounds(user["password"]) is None]
+            passwords = [user["password"] for user in plaintext]
+            hashed = pool.map(hash_password, passwords, repeat(rounds), chunksize=max(1, len(passwords) // workers))
+
+            with sqlite.transaction() as db:
+                db.executemany(
+                    update_password,
+                    ((pw_hash, user["id"], user["password"]) for pw_hash, user in zip(hashed, plaintext)),
                 )
+            last_id = users[-1]["id"]
+            write_checkpoint(checkpoint, last_id)
+
+            scanned += len(users)
+            migrated += len(plaintext)
+            elapsed = time.perf_counter() - start
+            print(f"Up to user id {last_id}: hashed {migrated} of {scanned} users ({scanned / elapsed:.0f} rows/s).")
+
+    elapsed = time.perf_counter() - start
+    rate = scanned / elapsed if elapsed else 0
+    print(f"Password migration completed successfully: hashed {migrated} of {scanned} users ({rate:.0f} rows/s).")
 
-        print("Password migration completed successfully.")
 
 if __name__ == "__main__":
-    migrate_passwords()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000, help="Users read and written per transaction")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes hashing passwords")
+    parser.add_argument("--checkpoint", type=Path, help="Checkpoint file, defaults to the instance folder")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first user")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        checkpoint = args.checkpoint or Path(app.instance_path) / "migrate_passwords.checkpoint"
+        migrate_passwords(args.batch_size, args.workers, checkpoint, args.restart)
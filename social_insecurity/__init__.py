@@ -3,23 +3,41 @@
 The package contains the Flask application factory.
 """
 
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from shutil import rmtree
 from typing import Optional, cast
 
+import click
 from flask import Flask, current_app
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 
+from social_insecurity.archive import archive_posts, optimize_archives
+from social_insecurity.cache import FragmentCache, UserCache
 from social_insecurity.config import Config
 from social_insecurity.database import SQLite3, User
+from social_insecurity.events import FeedEvents
+from social_insecurity.feed import rebuild_feeds, reconcile_comment_counts
+from social_insecurity.graph import FriendGraph
+from social_insecurity.hashing import PasswordHasher
+from social_insecurity.search import rebuild_search_index
+from social_insecurity.uploads import UploadStore
+from social_insecurity.writer import WriteQueue
 
 sqlite = SQLite3()
+user_cache = UserCache(sqlite)
+fragment_cache = FragmentCache()
+feed_events = FeedEvents(sqlite)
+friend_graph = FriendGraph(sqlite)
+write_queue = WriteQueue(sqlite)
 # TODO: Handle login management better, maybe with flask_login?
 login = LoginManager()
 # TODO: The passwords are stored in plaintext, this is not secure at all. I should probably use bcrypt or something
 bcrypt = Bcrypt()
+passwords = PasswordHasher()
+upload_store = UploadStore(sqlite)
 # TODO: The CSRF protection is not working, I should probably fix that
 csrf = CSRFProtect()
 
@@ -31,16 +49,21 @@ def create_app(test_config=None) -> Flask:
     if test_config:
         app.config.from_object(test_config)
 
-    sqlite.init_app(app, schema="schema.sql")
+    sqlite.init_app(app, schema="schema.sql", indexes="indexes.sql")
+    user_cache.init_app(app)
+    fragment_cache.init_app(app)
+    feed_events.init_app(app)
+    friend_graph.init_app(app)
+    write_queue.init_app(app)
     login.init_app(app)
     bcrypt.init_app(app)
+    passwords.init_app(app)
+    upload_store.init_app(app)
     csrf.init_app(app)
 
     @login.user_loader
     def load_user(user_id: str) -> Optional[User]:
-        db = sqlite.connection
-        user_query = "SELECT * FROM Users WHERE id = ?;"
-        user_data = db.execute(user_query, (user_id,)).fetchone()
+        user_data = user_cache.get(user_id)
 
         if user_data:
             return User(
@@ -60,6 +83,51 @@ def create_app(test_config=None) -> Flask:
         if instance_path.exists():
             rmtree(instance_path)
 
+    @app.cli.command("rebuild-feeds")
+    @click.option("--user", "user_id", type=int, default=None, help="Only rebuild the feed of this user id.")
+    def rebuild_feeds_command(user_id: Optional[int]) -> None:
+        """Backfill or rebuild the materialized feeds."""
+        with sqlite.transaction() as db:
+            rows = rebuild_feeds(db, user_id)
+        click.echo(f"Rebuilt feeds with {rows} rows.")
+
+    @app.cli.command("gc-uploads")
+    def gc_uploads_command() -> None:
+        """Remove uploaded images that no post refers to."""
+        rows, files = upload_store.collect_garbage()
+        click.echo(f"Deleted {rows} unused uploads and {files} files.")
+
+    @app.cli.command("rebuild-search")
+    def rebuild_search_command() -> None:
+        """Rebuild the full-text search indexes."""
+        with sqlite.transaction() as db:
+            rows = rebuild_search_index(db)
+        click.echo(f"Rebuilt search indexes with {rows} rows.")
+
+    @app.cli.command("reconcile-comment-counts")
+    def reconcile_comment_counts_command() -> None:
+        """Recompute the comment counts of all posts."""
+        with sqlite.transaction() as db:
+            posts = reconcile_comment_counts(db)
+        click.echo(f"Corrected the comment count of {posts} posts.")
+
+    @app.cli.command("archive")
+    @click.option("--days", type=int, default=None, help="Archive posts older than this many days.")
+    @click.option("--batch", "batch_size", type=int, default=None, help="Posts moved per transaction.")
+    @click.option("--no-vacuum", is_flag=True, help="Only analyze the databases, without reclaiming free pages.")
+    def archive_command(days: Optional[int], batch_size: Optional[int], no_vacuum: bool) -> None:
+        """Move old posts and their comments to the archives."""
+        days = days if days is not None else current_app.config["ARCHIVE_AFTER_DAYS"]
+        before = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        posts, comments = archive_posts(
+            sqlite,
+            before,
+            batch_size or current_app.config["ARCHIVE_BATCH_SIZE"],
+            current_app.config["ARCHIVE_PERIOD"],
+        )
+        click.echo(f"Archived {posts} posts and {comments} comments created before {before}.")
+        optimize_archives(sqlite, vacuum=not no_vacuum)
+
     with app.app_context():
         import social_insecurity.routes  # noqa: E402,F401
 
@@ -0,0 +1,287 @@
+"""Provides archival of old posts and comments for the Social Insecurity application.
+
+The archive command moves the posts older than ARCHIVE_AFTER_DAYS out of the Posts, Comments and Feeds tables,
+into one archive database per period (a year by default) in the archive folder of the instance. The hot tables,
+their indexes and the pages of them in the cache then only hold recent posts, however long the site has run.
+The Archives table of the main database lists the archives and the newest post in each. The newest post in any
+archive is the horizon: every post on either side of it is in the main database, or in an archive, respectively.
+
+Reading a timeline only touches the archives once its cursor has passed the horizon. The archives are then
+attached to the connection with ATTACH, once per connection, and read newest first until the page is full. The
+comments of an archived post are read from its archive. Archived posts are read-only, and are not found by search.
+
+Example:
+    from social_insecurity.archive import archive_posts, get_timeline_page
+
+    posts, next_cursor = get_timeline_page(sqlite.connection, user_id, before, page_size)
+    posts, comments = archive_posts(sqlite, "2024-01-01 00:00:00", period="%Y")
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from flask import current_app
+
+from social_insecurity.database import SQLite3
+from social_insecurity.feed import get_timeline
+from social_insecurity.pagination import encode_cursor, paginate
+
+ARCHIVE_FOLDER = "archive"
+ARCHIVE_SCHEMA = "archive.sql"
+ARCHIVE_NAME = re.compile(r"^archive_\w+$")
+
+
+class Archive(NamedTuple):
+    """Describes an archive database, and the newest post in it."""
+
+    name: str  # The schema name it is attached as
+    path: str  # The path to the file, relative to the instance folder
+    newest_time: str
+    newest_id: int
+
+
+def list_archives(db: sqlite3.Connection) -> list[Archive]:
+    """Returns the archives, newest first, or none if the database predates archival."""
+    get_archives = "SELECT name, path, newest_time, newest_id FROM Archives ORDER BY newest_time DESC, newest_id DESC;"
+    try:
+        return [Archive(*row) for row in db.execute(get_archives)]
+    except sqlite3.OperationalError:
+        return []
+
+
+def attach_archives(db: sqlite3.Connection, archives: list[Archive]) -> None:
+    """Attaches the archives to the connection, unless they are attached already. Must not run in a transaction."""
+    attached = {row[1] for row in db.execute("PRAGMA database_list;")}
+    for archive in archives:
+        if archive.name not in attached:
+            if not ARCHIVE_NAME.match(archive.name):
+                raise ValueError(f"Invalid archive name: {archive.name}")
+            db.execute(f"ATTACH DATABASE ? AS {archive.name};", (str(Path(current_app.instance_path) / archive.path),))
+
+
+def get_timeline_page(
+    db: sqlite3.Connection, user_id: int, before: tuple[str, int], page_size: int
+) -> tuple[list[sqlite3.Row], Optional[str]]:
+    """Reads a page of a user's timeline, from the archives if the cursor has passed the horizon.
+
+    The last page before the horizon ends early, with a cursor at the horizon, so that the archives are only
+    read when the reader asks for more.
+
+    params:
+        db: The connection to read from.
+        user_id: The id of the user whose timeline is read.
+        before: The key that all posts on the page sort before.
+        page_size: The number of posts on a page.
+
+    returns: The posts on the page and the cursor of the next page, or None if this is the last page.
+
+    """
+    posts = get_timeline(db, user_id, before, page_size + 1)
+    archives = list_archives(db)
+    if not archives:
+        return paginate(posts, page_size)
+
+    horizon = (archives[0].newest_time, archives[0].newest_id)
+    if before > horizon:
+        posts = [post for post in posts if (post["creation_time"], post["id"]) > horizon]
+        if len(posts) > page_size:
+            return paginate(posts, page_size)
+        return posts, encode_cursor(horizon[0], horizon[1] + 1)
+
+    attach_archives(db, archives)
+    for archive in archives:
+        if len(posts) > page_size:
+            break
+        get_posts = f"""
+            SELECT p.id, p.u_id, p.content, p.image, p.creation_time, p.comment_count AS cc, u.username
+            FROM {archive.name}.Feeds AS f
+            JOIN {archive.name}.Posts AS p ON p.id = f.p_id
+            JOIN main.Users AS u ON u.id = p.u_id
+            WHERE f.u_id = ? AND (f.creation_time, f.p_id) < (?, ?)
+            ORDER BY f.creation_time DESC, f.p_id DESC
+            LIMIT ?;
+        """
+        posts += db.execute(get_posts, (user_id, *before, page_size + 1)).fetchall()
+    posts.sort(key=lambda post: (post["creation_time"], post["id"]), reverse=True)
+    return paginate(posts[: page_size + 1], page_size)
+
+
+def find_archived_post(db: sqlite3.Connection, post_id: int) -> tuple[Optional[str], Optional[sqlite3.Row]]:
+    """Returns the name of the archive holding a post and the post with its author, or (None, None)."""
+    archives = list_archives(db)
+    attach_archives(db, archives)
+    for archive in archives:
+        get_post = f"SELECT * FROM {archive.name}.Posts AS p JOIN main.Users AS u ON p.u_id = u.id WHERE p.id = ?;"
+        post = db.execute(get_post, (post_id,)).fetchone()
+        if post is not None:
+            return archive.name, post
+    return None, None
+
+
+def get_archived_comments(
+    db: sqlite3.Connection, archive_name: str, post_id: int, before: tuple[str, int], limit: int
+) -> list[sqlite3.Row]:
+    """Returns the comments on an archived post, newest first, like the comments page of a post in the main database.
+
+    params:
+        db: The connection to read from, with the archive attached.
+        archive_name: The name of the archive holding the post, see find_archived_post.
+        post_id: The id of the post.
+        before: The key that all comments returned sort before.
+        limit: The maximum number of comments to return.
+
+    returns: The comments with the username of their author.
+
+    """
+    if not ARCHIVE_NAME.match(archive_name):
+        raise ValueError(f"Invalid archive name: {archive_name}")
+    get_comments = f"""
+        SELECT c.id, c.comment, c.creation_time, u.username
+        FROM {archive_name}.Comments AS c JOIN main.Users AS u ON c.u_id = u.id
+        WHERE c.p_id = ? AND (c.creation_time, c.id) < (?, ?)
+        ORDER BY c.creation_time DESC, c.id DESC
+        LIMIT ?;
+    """
+    return db.execute(get_comments, (post_id, *before, limit)).fetchall()
+
+
+def count_archived_images(db: sqlite3.Connection) -> dict[str, int]:
+    """Returns how many archived posts refer to each image, so that archived images are not garbage collected."""
+    archives = list_archives(db)
+    attach_archives(db, archives)
+    counts: dict[str, int] = {}
+    for archive in archives:
+        count_references = f"""
+            SELECT image, COUNT(*) AS n FROM {archive.name}.Posts WHERE image IS NOT NULL GROUP BY image;
+        """
+        for image, references in db.execute(count_references):
+            counts[image] = counts.get(image, 0) + references
+    return counts
+
+
+def open_archive(db: sqlite3.Connection, period: str) -> Archive:
+    """Creates the archive of a period if it does not exist yet, and attaches it. Must not run in a transaction.
+
+    params:
+        db: The connection to attach the archive to.
+        period: The period of the archive, as formatted with ARCHIVE_PERIOD, e.g. "2023".
+
+    returns: The archive. Its newest post is left empty, it is kept up to date in the Archives table.
+
+    """
+    suffix = re.sub(r"\W", "_", period)
+    name, path = f"archive_{suffix}", Path(ARCHIVE_FOLDER) / f"{suffix}.db"
+    full_path = Path(current_app.instance_path) / path
+    full_path.parent.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(full_path)) as archive_db:
+        with current_app.open_resource(ARCHIVE_SCHEMA, mode="r") as file:
+            archive_db.executescript(file.read())
+    archive = Archive(name, path.as_posix(), "", 0)
+    attach_archives(db, [archive])
+    return archive
+
+
+def move_posts(db: sqlite3.Connection, archive: Archive, post_ids: list[int]) -> tuple[int, int]:
+    """Copies posts, their comments and their timeline rows to an archive, and deletes them from the main database.
+
+    params:
+        db: The connection to write to, with the archive attached. The caller is responsible for committing.
+        archive: The archive to move the posts to.
+        post_ids: The ids of the posts to move.
+
+    returns: The number of posts and comments moved.
+
+    """
+    ids = json.dumps(post_ids)
+    copy_posts = f"""
+        INSERT INTO {archive.name}.Posts (id, u_id, content, image, creation_time, comment_count)
+        SELECT id, u_id, content, image, creation_time, comment_count
+        FROM main.Posts WHERE id IN (SELECT value FROM json_each(?));
+    """
+    copy_comments = f"""
+        INSERT INTO {archive.name}.Comments (id, p_id, u_id, comment, creation_time)
+        SELECT id, p_id, u_id, comment, creation_time
+        FROM main.Comments WHERE p_id IN (SELECT value FROM json_each(?));
+    """
+    copy_feeds = f"""
+        INSERT OR IGNORE INTO {archive.name}.Feeds (u_id, p_id, creation_time)
+        SELECT u_id, p_id, creation_time
+        FROM main.Feeds WHERE p_id IN (SELECT value FROM json_each(?));
+    """
+    update_horizon = f"""
+        INSERT INTO main.Archives (name, path, newest_time, newest_id)
+        SELECT ?, ?, creation_time, id FROM {archive.name}.Posts WHERE true ORDER BY creation_time DESC, id DESC LIMIT 1
+        ON CONFLICT (name) DO UPDATE SET newest_time = excluded.newest_time, newest_id = excluded.newest_id;
+    """
+    for copy in (copy_posts, copy_comments, copy_feeds):
+        db.execute(copy, (ids,))
+    db.execute("DELETE FROM main.Feeds WHERE p_id IN (SELECT value FROM json_each(?));", (ids,))
+    comments = db.execute("DELETE FROM main.Comments WHERE p_id IN (SELECT value FROM json_each(?));", (ids,)).rowcount
+    posts = db.execute("DELETE FROM main.Posts WHERE id IN (SELECT value FROM json_each(?));", (ids,)).rowcount
+    db.execute(update_horizon, (archive.name, archive.path))
+    return posts, comments
+
+
+def archive_posts(db: SQLite3, before: str, batch_size: int = 1000, period: str = "%Y") -> tuple[int, int]:
+    """Moves the posts created before a time, with their comments and timeline rows, to the archives.
+
+    Each batch is moved in a transaction of its own, so archiving can be interrupted and resumed. The newest post,
+    and the post with the newest comment, are never archived, so that SQLite does not reuse their ids.
+
+    params:
+        db: The database extension to archive from.
+        before: The time, as YYYY-MM-DD HH:MM:SS, that archived posts were created before.
+        batch_size (optional): The number of posts moved per transaction.
+        period (optional): The strftime format naming the archive of a post, "%Y" for one archive per year.
+
+    returns: The number of posts and comments archived.
+
+    """
+    create_archives = """
+        CREATE TABLE IF NOT EXISTS main.Archives (
+            name TEXT PRIMARY KEY, path TEXT NOT NULL, newest_time DATETIME, newest_id INTEGER
+        ) WITHOUT ROWID;
+    """
+    get_candidates = """
+        SELECT id, strftime(?, creation_time) AS period
+        FROM Posts
+        WHERE creation_time < ?
+            AND id < (SELECT MAX(id) FROM Posts)
+            AND id IS NOT (SELECT p_id FROM Comments WHERE id = (SELECT MAX(id) FROM Comments))
+        ORDER BY id;
+    """
+    conn = db.connection
+    conn.execute(create_archives)
+    candidates = conn.execute(get_candidates, (period, before)).fetchall()
+    posts = comments = 0
+    for start in range(0, len(candidates), batch_size):
+        by_period: dict[str, list[int]] = {}
+        for post_id, post_period in candidates[start : start + batch_size]:
+            by_period.setdefault(post_period, []).append(post_id)
+        archives = {post_period: open_archive(conn, post_period) for post_period in by_period}
+        with db.transaction() as tx:
+            for post_period, post_ids in by_period.items():
+                moved = move_posts(tx, archives[post_period], post_ids)
+                posts += moved[0]
+                comments += moved[1]
+    if posts:
+        with db.transaction() as tx:
+            tx.execute("UPDATE FeedVersions SET version = version + 1;")
+    return posts, comments
+
+
+def optimize_archives(db: SQLite3, vacuum: bool = True) -> None:
+    """Refreshes the query planner statistics of the main database and the archives, and reclaims free pages."""
+    conn = db.connection
+    archives = list_archives(conn)
+    attach_archives(conn, archives)
+    for name in ["main", *(archive.name for archive in archives)]:
+        conn.execute(f"ANALYZE {name};")
+        if vacuum:
+            conn.execute(f"VACUUM {name};")
@@ -0,0 +1,40 @@
+-- --
+-- Create the tables of an archive database
+--
+-- Archives hold the posts of one period, with their comments and the timeline rows that point to them.
+-- They are written by the archive command and otherwise only read.
+-- --
+
+CREATE TABLE IF NOT EXISTS [Posts](
+  id INTEGER PRIMARY KEY,
+  u_id INTEGER,
+  content INTEGER,
+  [image] VARCHAR,
+  [creation_time] DATETIME,
+  comment_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS [Comments](
+  id INTEGER PRIMARY KEY,
+  p_id INTEGER,
+  u_id INTEGER,
+  comment VARCHAR,
+  [creation_time] DATETIME
+);
+
+CREATE TABLE IF NOT EXISTS [Feeds](
+  u_id INTEGER NOT NULL,
+  p_id INTEGER NOT NULL,
+  [creation_time] DATETIME,
+  PRIMARY KEY (u_id, creation_time, p_id)
+) WITHOUT ROWID;
+
+-- --
+-- Create secondary indexes
+-- --
+
+-- Newest archived post, for the horizon of the archive
+CREATE INDEX IF NOT EXISTS [posts_creation_time] ON [Posts](creation_time, id);
+
+-- Comments on a post, newest first, for the comments page of an archived post
+CREATE INDEX IF NOT EXISTS [comments_p_id_creation_time] ON [Comments](p_id, creation_time, id);
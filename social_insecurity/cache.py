@@ -0,0 +1,190 @@
+"""Provides in-process caches for the Social Insecurity application.
+
+This file contains a bounded LRU cache and the user and fragment caches built on it.
+
+Example:
+    from social_insecurity import fragment_cache, user_cache
+
+    # Read the row of the logged in user, from the cache when possible
+    user = user_cache.get(current_user.id)
+
+    # Drop the cached row after changing it
+    user_cache.invalidate(current_user.id)
+
+    # Render a post card, reusing the cached HTML while its comment count is unchanged
+    html = fragment_cache.render("post_card.html.j2", post["id"], post["cc"], post=post)
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Hashable, Optional
+
+from flask import Flask, g, render_template
+from markupsafe import Markup
+
+from social_insecurity.database import SQLite3
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Provides a thread-safe cache that evicts the least recently used entry when it is full.
+
+    Entries can also expire a fixed number of seconds after they were set.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None) -> None:
+        """Initializes the cache.
+
+        params:
+            maxsize: The maximum number of entries in the cache.
+            ttl (optional): The number of seconds an entry stays valid. Entries never expire if omitted.
+
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the value for the key, or the default if it is missing or expired."""
+        with self._lock:
+            expires, value = self._entries.get(key, (0.0, _MISSING))
+            if value is _MISSING or (self.ttl is not None and expires < monotonic()):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Sets the value for the key, evicting the least recently used entry if the cache is full."""
+        expires = monotonic() + self.ttl if self.ttl is not None else 0.0
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Removes the key from the cache, if it is there."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Removes all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class UserCache:
+    """Provides a cache of rows from the Users table, looked up by id.
+
+    A row is read at most once per request, and is kept across requests in a bounded LRU cache
+    until it expires or is invalidated. Rows changed by another process are seen once they expire.
+    """
+
+    def __init__(self, db: SQLite3, app: Optional[Flask] = None) -> None:
+        """Initializes the extension.
+
+        params:
+            db: The database extension to read users from.
+            app (optional): The Flask application to initialize the extension with.
+
+        """
+        self._db = db
+        self._rows = LRUCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension with the USER_CACHE_SIZE and USER_CACHE_TTL settings of the app."""
+        app.extensions["user_cache"] = self
+        self._rows = LRUCache(app.config.get("USER_CACHE_SIZE", 1024), app.config.get("USER_CACHE_TTL", 60))
+
+    def get(self, user_id: int | str) -> Optional[sqlite3.Row]:
+        """Returns the row of the user with the given id, or None if there is no such user."""
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return None
+
+        request_rows = g.setdefault("user_cache_rows", {})
+        if user_id in request_rows:
+            return request_rows[user_id]
+
+        row = self._rows.get(user_id)
+        if row is None:
+            row = self._db.read("SELECT * FROM Users WHERE id = ?;", user_id, one=True)
+            if row is not None:
+                self._rows.set(user_id, row)
+        request_rows[user_id] = row
+        return row
+
+    def invalidate(self, user_id: int | str) -> None:
+        """Drops the cached row of the user, so that the next lookup reads it from the database."""
+        user_id = int(user_id)
+        self._rows.pop(user_id)
+        g.get("user_cache_rows", {}).pop(user_id, None)
+
+
+class FragmentCache:
+    """Provides a cache of rendered template fragments, such as the post cards on the stream.
+
+    A fragment is cached under its template and key together with a version, e.g. the comment count of a post.
+    A cached fragment is reused only while the version passed in matches, so changes made by other processes
+    are picked up from the rows being rendered. Fragments must not depend on who is viewing them.
+    """
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        """Initializes the extension.
+
+        params:
+            app (optional): The Flask application to initialize the extension with.
+
+        """
+        self._fragments = LRUCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension with the FRAGMENT_CACHE_SIZE setting of the app.
+
+        Templates can render cached fragments with the render_fragment function.
+        """
+        app.extensions["fragment_cache"] = self
+        self._fragments = LRUCache(app.config.get("FRAGMENT_CACHE_SIZE", 4096))
+        app.jinja_env.globals["render_fragment"] = self.render
+
+    def render(self, template: str, key: Hashable, version: Hashable = None, **context: Any) -> Markup:
+        """Returns the rendered template, from the cache if it was rendered before with the same key and version.
+
+        params:
+            template: The name of the template to render.
+            key: The key of the fragment within the template, e.g. the id of a post.
+            version (optional): The version of the fragment. A cached fragment with another version is re-rendered.
+            context: The variables to render the template with.
+
+        returns: The rendered HTML.
+
+        """
+        cached = self._fragments.get((template, key))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        html = Markup(render_template(template, **context))
+        self._fragments.set((template, key), (version, html))
+        return html
+
+    def invalidate(self, template: str, key: Hashable) -> None:
+        """Drops the cached fragment, so that it is rendered again the next time."""
+        self._fragments.pop((template, key))
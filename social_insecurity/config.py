@@ -32,3 +32,44 @@ class Config:
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024
     WTF_CSRF_ENABLED = True  
     REMEMBER_COOKIE_DURATION = timedelta(days=2)
+    FEED_PAGE_SIZE = 20  # Number of posts or comments shown per page
+    SQLITE3_POOL_SIZE = 8  # Number of idle database connections kept open per process
+    SQLITE3_CACHE_SIZE = 16 * 1024  # Page cache per connection, in KiB
+    SQLITE3_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file to memory map per connection
+    SQLITE3_BUSY_TIMEOUT = 5000  # Milliseconds to wait for a lock held by another connection
+    USER_CACHE_SIZE = 1024  # Number of user rows cached across requests per process
+    USER_CACHE_TTL = 60  # Seconds a cached user row is used before it is read again
+    BCRYPT_LOG_ROUNDS = 12  # bcrypt cost factor, hashes with another cost are rehashed on login
+    PASSWORD_HASHER_WORKERS = None  # Processes hashing passwords, None for one per CPU, 0 to hash on the request thread
+    PASSWORD_HASHER_MAX_PENDING = None  # Hashes allowed to wait for a worker, None for four per worker
+    PASSWORD_HASHER_TIMEOUT = 5  # Seconds to wait for room in the queue before answering 503
+    IMAGE_VARIANTS = {"thumb": (160, 160), "preview": (640, 640)}  # Largest (width, height) of each image variant
+    IMAGE_VARIANT_WORKERS = 1  # Processes making image variants, 0 to make them on the request thread
+    IMAGE_VARIANT_MAX_PENDING = 32  # Images allowed to wait for variants, later ones are served without them
+    UPLOADS_GC_GRACE = 3600  # Seconds an unused upload is kept before gc-uploads deletes it
+    UPLOADS_MAX_AGE = 365 * 24 * 3600  # Seconds browsers may cache a content-addressed upload
+    UPLOADS_SENDFILE = None  # "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd) to let the proxy send uploads
+    UPLOADS_ACCEL_PREFIX = "/protected-uploads/"  # Internal nginx location that maps to the uploads folder
+    RATELIMIT_STORAGE_URI = None  # Rate limit counters, None for ratelimit.db in the instance folder shared by all workers
+    RATELIMIT_STRATEGY = "sliding-window-counter"  # Constant memory per key, smooths bursts at window edges
+    RATELIMIT_LIMITS = {"index": "1000 per day"}  # Rate limits by endpoint name
+    FRAGMENT_CACHE_SIZE = 4096  # Number of rendered post and comment cards cached per process
+    FEED_EVENTS_SHARED = True  # Exchange live feed updates between worker processes through the database
+    FEED_EVENTS_POLL_INTERVAL = 1  # Seconds between checks for feed updates made by other worker processes
+    FEED_EVENTS_RETENTION = 300  # Seconds feed updates are kept in the database for other processes to read
+    FEED_EVENTS_QUEUE_SIZE = 100  # Updates waiting for a slow client before it is told to reload instead
+    FEED_EVENTS_KEEPALIVE = 15  # Seconds between keepalive comments on an idle event stream
+    FEED_EVENTS_MAX_DURATION = 300  # Seconds an event stream is kept open before the browser reconnects
+    SEARCH_MAX_PAGES = 10  # Pages of search results that can be read, each FEED_PAGE_SIZE results long
+    SQLITE3_SLOW_QUERY_MS = 100  # Statements taking longer are logged with their query plan, None to log none
+    SQLITE3_SLOW_QUERY_LOG = None  # File relative to the instance folder that slow queries are appended to
+    SQLITE3_SERVER_TIMING = True  # Report the statements of each request and their duration in a Server-Timing header
+    METRICS_ENABLED = True  # Serve the per-endpoint statement totals of the process at /metrics
+    WRITE_QUEUE_ENABLED = False  # Commit new posts and comments in batches on a writer thread per worker process
+    WRITE_QUEUE_MAX_BATCH = 64  # Writes committed together at most
+    WRITE_QUEUE_MAX_DELAY = 2  # Milliseconds the writer waits for more writes before committing a batch
+    WRITE_QUEUE_MAX_PENDING = 1024  # Writes allowed to wait for the writer
+    WRITE_QUEUE_TIMEOUT = 5  # Seconds to wait for room in the queue before answering 503
+    ARCHIVE_AFTER_DAYS = 365  # Days after which the archive command moves posts and their comments to the archives
+    ARCHIVE_PERIOD = "%Y"  # strftime format naming the archive of a post, at most 9 archives can be read through
+    ARCHIVE_BATCH_SIZE = 1000  # Posts moved to the archives per transaction
@@ -2,6 +2,12 @@
 
 This extension provides a simple interface to the SQLite3 database.
 
+Every statement run on one of its connections is timed, including statements run with connection.execute
+directly. The statements of a request are summed up in a Server-Timing header, added to per-endpoint totals for
+the /metrics endpoint, and logged with their query plan to the social_insecurity.slow_queries logger if they take
+longer than SQLITE3_SLOW_QUERY_MS. A statement is timed until its first row is ready, which includes any sorting,
+but not the time spent fetching the remaining rows.
+
 Example:
     from flask import Flask
     from social_insecurity.database import SQLite3
@@ -12,14 +18,22 @@ Example:
 
 from __future__ import annotations
 
+import logging
 import sqlite3
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
 from os import PathLike
 from pathlib import Path
-from typing import Any, Optional, cast
+from queue import Empty, Full, LifoQueue
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, NamedTuple, Optional, cast
 
-from flask import Flask, current_app, g
+from flask import Flask, Response, current_app, g, has_app_context, has_request_context, request
 from flask_login import UserMixin
 
+slow_query_logger = logging.getLogger("social_insecurity.slow_queries")
+
 
 class User(UserMixin):
     def __init__(self, id, username, password):
@@ -33,12 +47,62 @@ class User(UserMixin):
 
 
 
+class StatementTiming(NamedTuple):
+    """Describes a statement run during a request and how long it took, in seconds."""
+
+    sql: str
+    duration: float
+
+
+class QueryTotals(NamedTuple):
+    """Describes the statements run by the requests to one endpoint, since the process started."""
+
+    requests: int
+    queries: int
+    duration: float
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Provides a connection that reports every statement it runs, and how long it took, to a callback."""
+
+    on_statement: Optional[Callable[[InstrumentedConnection, str, Any, float], None]] = None
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            if self.on_statement is not None:
+                self.on_statement(self, sql, parameters, perf_counter() - start)
+
+    def executemany(self, sql: str, parameters: Iterable[Any], /) -> sqlite3.Cursor:
+        start = perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            if self.on_statement is not None:
+                self.on_statement(self, sql, None, perf_counter() - start)
+
+    def explain(self, sql: str, parameters: Any) -> list[str]:
+        """Returns the lines of the query plan of a statement, indented by depth, without reporting it."""
+        rows = super().execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+        depth: dict[int, int] = {0: -1}
+        lines = []
+        for node_id, parent_id, _, detail in rows:
+            depth[node_id] = depth.get(parent_id, -1) + 1
+            lines.append("  " * depth[node_id] + detail)
+        return lines
+
+
 class SQLite3:
     """Provides a SQLite3 database extension for Flask.
 
     This class provides a simple interface to the SQLite3 database.
     It also initializes the database if it does not exist yet.
 
+    Connections are kept open in a pool that is shared by all threads, and are configured once
+    when they are opened, with write-ahead logging so that readers do not block behind writers.
+
     Example:
         from flask import Flask
         from social_insecurity.database import SQLite3
@@ -47,9 +111,10 @@ class SQLite3:
         db = SQLite3(app)
 
         # Use the database
-        # db.query("SELECT * FROM Users;")
-        # db.query("SELECT * FROM Users WHERE id = 1;", one=True)
-        # db.query("INSERT INTO Users (name, email) VALUES ('John', 'test@test.net');")
+        # db.read("SELECT * FROM Users;")
+        # db.read("SELECT * FROM Users WHERE id = ?;", 1, one=True)
+        # with db.transaction():
+        #     db.write("INSERT INTO Users (name, email) VALUES (?, ?);", "John", "test@test.net")
     """
 
     def __init__(
@@ -58,6 +123,7 @@ class SQLite3:
         *,
         path: Optional[PathLike | str] = None,
         schema: Optional[PathLike | str] = None,
+        indexes: Optional[PathLike | str] = None,
     ) -> None:
         """Initializes the extension.
 
@@ -65,10 +131,11 @@ class SQLite3:
             app: The Flask application to initialize the extension with.
             path (optional): The path to the database file. Is relative to the instance folder.
             schema (optional): The path to the schema file. Is relative to the application root folder.
+            indexes (optional): The path to the index file. Is relative to the application root folder.
 
         """
         if app is not None:
-            self.init_app(app, path=path, schema=schema)
+            self.init_app(app, path=path, schema=schema, indexes=indexes)
 
     def init_app(
         self,
@@ -76,6 +143,7 @@ class SQLite3:
         *,
         path: Optional[PathLike | str] = None,
         schema: Optional[PathLike | str] = None,
+        indexes: Optional[PathLike | str] = None,
     ) -> None:
         """Initializes the extension.
 
@@ -83,6 +151,8 @@ class SQLite3:
             app: The Flask application to initialize the extension with.
             path (optional): The path to the database file. Is relative to the instance folder.
             schema (optional): The path to the schema file. Is relative to the application root folder.
+            indexes (optional): The path to the index file. Is relative to the application root folder.
+                Its statements must be idempotent, as they are run on every start.
 
         """
         if not hasattr(app, "extensions"):
@@ -105,26 +175,104 @@ class SQLite3:
             raise ValueError("No database path provided to SQLite3 extension")
 
         if not self._path.exists():
-            self._path.parent.mkdir(parents=True)
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._pragmas = {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -int(app.config.get("SQLITE3_CACHE_SIZE", 2000)),
+            "mmap_size": int(app.config.get("SQLITE3_MMAP_SIZE", 0)),
+            "busy_timeout": int(app.config.get("SQLITE3_BUSY_TIMEOUT", 5000)),
+        }
+        self._pool: LifoQueue[sqlite3.Connection] = LifoQueue(maxsize=int(app.config.get("SQLITE3_POOL_SIZE", 8)))
+        self._pool_lock = Lock()
+        self._pool_hits = 0
+        self._pool_misses = 0
+
+        slow_query_ms = app.config.get("SQLITE3_SLOW_QUERY_MS", 100)
+        self._slow_query_threshold = slow_query_ms / 1000 if slow_query_ms is not None else None
+        self._server_timing = bool(app.config.get("SQLITE3_SERVER_TIMING", True))
+        self._totals: dict[str, QueryTotals] = {}
+        self._totals_lock = Lock()
+        self.slow_queries = 0
+        slow_query_log = app.config.get("SQLITE3_SLOW_QUERY_LOG")
+        if slow_query_log:
+            log_path = str(instance_path / slow_query_log)
+            handlers = slow_query_logger.handlers
+            if not any(getattr(handler, "baseFilename", None) == log_path for handler in handlers):
+                handler = logging.FileHandler(log_path)
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                slow_query_logger.addHandler(handler)
+
+        app.before_request(self._start_request)
+        app.after_request(self._add_server_timing)
+        app.teardown_request(self._add_to_totals)
+        app.teardown_appcontext(self._close_connection)
 
         if schema and not self._path.exists():
             with app.app_context():
                 self._init_database(schema)
 
-        app.teardown_appcontext(self._close_connection)
+        if indexes:
+            with app.app_context():
+                self._init_database(indexes)
 
     @property
     def connection(self) -> sqlite3.Connection:
-        """Returns the connection to the SQLite3 database."""
+        """Returns the connection to the SQLite3 database.
+
+        The connection is taken from the pool the first time it is used in an app context,
+        and returned to the pool when the app context is torn down.
+        """
         conn = getattr(g, "flask_sqlite3_connection", None)
         if conn is None:
-            conn = g.flask_sqlite3_connection = sqlite3.connect(self._path)
-            conn.row_factory = sqlite3.Row
+            conn = g.flask_sqlite3_connection = self._acquire_connection()
         return conn
 
+    @property
+    def pool_stats(self) -> dict[str, int]:
+        """Returns the size of the connection pool and how often a pooled connection could be reused."""
+        with self._pool_lock:
+            return {
+                "size": self._pool.maxsize,
+                "idle": self._pool.qsize(),
+                "hits": self._pool_hits,
+                "misses": self._pool_misses,
+            }
+
+    @property
+    def query_totals(self) -> dict[str, QueryTotals]:
+        """Returns the number of requests, statements and seconds spent running them, by endpoint."""
+        with self._totals_lock:
+            return dict(self._totals)
+
+    @property
+    def statements(self) -> list[StatementTiming]:
+        """Returns the statements run in the current app context so far, in the order they were run."""
+        return g.setdefault("flask_sqlite3_statements", [])
+
     def query(self, query: str, *args, one: bool = False) -> Any:
         """Queries the database and returns the result.'
 
+        Connections are in autocommit mode, so a statement that changes the database is committed on its own,
+        unless it runs inside transaction(). Prefer read() and write(), which make the intent explicit.
+
+        params:
+            query: The SQL query to execute.
+            one: Whether to return a single row or a list of rows.
+            args: Additional arguments to pass to the query.
+
+        returns: A single row, a list of rows or None.
+
+        """
+        cursor = self.connection.execute(query, args)
+        response = cursor.fetchone() if one else cursor.fetchall()
+        cursor.close()
+        return response
+
+    def read(self, query: str, *args, one: bool = False) -> Any:
+        """Runs a query that only reads from the database and returns the result. Never commits.
+
         params:
             query: The SQL query to execute.
             one: Whether to return a single row or a list of rows.
@@ -136,19 +284,133 @@ class SQLite3:
         cursor = self.connection.execute(query, args)
         response = cursor.fetchone() if one else cursor.fetchall()
         cursor.close()
-        self.connection.commit()
         return response
 
-    # TODO: Add more specific query methods to simplify code
+    def write(self, query: str, *args) -> sqlite3.Cursor:
+        """Runs a statement that changes the database.
+
+        Inside transaction() the statement becomes part of that transaction,
+        otherwise it is committed on its own.
+
+        params:
+            query: The SQL statement to execute.
+            args: Additional arguments to pass to the statement.
+
+        returns: The cursor, for reading lastrowid and rowcount.
+
+        """
+        return self.connection.execute(query, args)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Groups the statements run in the block into a single transaction.
+
+        The transaction is committed when the block exits, or rolled back if it raises.
+        A transaction started inside another transaction joins the outer one.
+
+        Example:
+            with db.transaction() as conn:
+                conn.execute("INSERT INTO Posts (u_id, content) VALUES (?, ?);", (1, "Hello"))
+                db.write("UPDATE Users SET music = ? WHERE id = ?;", "Jazz", 1)
+
+        returns: The connection the transaction runs on.
+
+        """
+        conn = self.connection
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK;")
+            raise
+        conn.execute("COMMIT;")
 
     def _init_database(self, schema: PathLike | str) -> None:
-        """Initializes the database with the supplied schema if it does not exist yet."""
+        """Runs the supplied SQL script against the database."""
         with current_app.open_resource(str(schema), mode="r") as file:
             self.connection.executescript(file.read())
-            self.connection.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a new connection to the database and configures it."""
+        conn = sqlite3.connect(
+            self._path, check_same_thread=False, isolation_level=None, factory=InstrumentedConnection
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma, value in self._pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value};")
+        conn.on_statement = self._record_statement
+        return conn
+
+    def _record_statement(self, conn: InstrumentedConnection, sql: str, parameters: Any, duration: float) -> None:
+        """Adds a statement to those of the current app context, and logs it if it was slow."""
+        if has_app_context():
+            self.statements.append(StatementTiming(sql, duration))
+        if self._slow_query_threshold is not None and duration >= self._slow_query_threshold:
+            self.slow_queries += 1
+            try:
+                plan = conn.explain(sql, parameters) if parameters is not None else []
+            except sqlite3.Error:
+                plan = []
+            endpoint = request.endpoint if has_request_context() else None
+            slow_query_logger.warning(
+                "Slow query (%.1f ms, endpoint %s): %s\n%s",
+                duration * 1000,
+                endpoint,
+                " ".join(sql.split()),
+                "\n".join(plan),
+            )
+
+    def _start_request(self) -> None:
+        g.flask_sqlite3_request_start = perf_counter()
+
+    def _add_server_timing(self, response: Response) -> Response:
+        """Adds the number of statements and the time spent running them to the Server-Timing header."""
+        if self._server_timing:
+            statements = self.statements
+            duration = sum(statement.duration for statement in statements)
+            response.headers.add("Server-Timing", f'db;dur={duration * 1000:.2f};desc="{len(statements)} queries"')
+            start = g.get("flask_sqlite3_request_start")
+            if start is not None:
+                response.headers.add("Server-Timing", f"app;dur={(perf_counter() - start) * 1000:.2f}")
+        return response
+
+    def _add_to_totals(self, exception: Optional[BaseException] = None) -> None:
+        """Adds the statements of the request to the totals of its endpoint."""
+        statements = g.pop("flask_sqlite3_statements", [])
+        endpoint = request.endpoint or "unknown"
+        duration = sum(statement.duration for statement in statements)
+        with self._totals_lock:
+            totals = self._totals.get(endpoint, QueryTotals(0, 0, 0.0))
+            self._totals[endpoint] = QueryTotals(
+                totals.requests + 1, totals.queries + len(statements), totals.duration + duration
+            )
+
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """Takes an idle connection from the pool, or opens a new one if the pool is empty."""
+        try:
+            conn = self._pool.get_nowait()
+        except Empty:
+            with self._pool_lock:
+                self._pool_misses += 1
+            return self._connect()
+        with self._pool_lock:
+            self._pool_hits += 1
+        return conn
 
     def _close_connection(self, exception: Optional[BaseException] = None) -> None:
-        """Closes the connection to the database."""
-        conn = cast(sqlite3.Connection, getattr(g, "flask_sqlite3_connection", None))
-        if conn is not None:
+        """Returns the connection to the pool, or closes it if the pool is full.
+
+        Changes that were not committed are rolled back, just like when a connection is closed.
+        """
+        conn = cast(Optional[sqlite3.Connection], g.pop("flask_sqlite3_connection", None))
+        if conn is None:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put_nowait(conn)
+        except (sqlite3.Error, Full):
             conn.close()
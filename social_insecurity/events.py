@@ -0,0 +1,215 @@
+"""Provides live feed updates for the Social Insecurity application.
+
+Clients connected to the stream over Server-Sent Events subscribe to the changes of their own timeline. When a
+post is created or commented on, the route publishes the change after committing it, and every subscriber whose
+timeline holds the post is notified at once.
+
+A subscriber connected to another worker process would miss changes published in memory, so changes are also
+written to the FeedChanges table in the transaction that makes them. Every process with subscribers polls the
+table and delivers the changes made by other processes. Set FEED_EVENTS_SHARED to False when running a single
+worker process to skip the table.
+
+Example:
+    from social_insecurity import feed_events
+
+    with sqlite.transaction() as db:
+        post_id = db.execute(insert_post, args).lastrowid
+        feed_events.record(db, "post", post_id)
+    feed_events.publish("post", post_id)
+
+    with feed_events.subscribe(user_id) as subscription:
+        event = subscription.get(timeout=15)
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from queue import Empty, Full, Queue
+from typing import Any, NamedTuple, Optional
+
+from flask import Flask
+
+from social_insecurity.database import SQLite3
+
+# Delete old changes from the log every this many polls
+PRUNE_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+class FeedEvent(NamedTuple):
+    """Describes a change to the posts on some timelines."""
+
+    kind: str
+    post_id: int
+
+
+# Put in a subscription that fell too far behind, telling the client to reload instead
+OVERFLOW = FeedEvent("reset", 0)
+
+
+class Subscription:
+    """Provides the changes to one user's timeline, in the order they were published."""
+
+    def __init__(self, user_id: int, maxsize: int) -> None:
+        self.user_id = user_id
+        self._queue: Queue[FeedEvent] = Queue(maxsize)
+        self._overflowed = False
+
+    def get(self, timeout: float) -> Optional[FeedEvent]:
+        """Returns the next change, OVERFLOW if changes were dropped, or None if none came within the timeout."""
+        if self._overflowed:
+            return OVERFLOW
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def put(self, event: FeedEvent) -> None:
+        """Queues a change, marking the subscription as overflowed if its queue is full."""
+        try:
+            self._queue.put_nowait(event)
+        except Full:
+            self._overflowed = True
+
+
+class FeedEvents:
+    """Provides an in-process publish and subscribe channel for timeline changes.
+
+    With FEED_EVENTS_SHARED set, changes are also exchanged between worker processes through the FeedChanges
+    table, which a background thread polls every FEED_EVENTS_POLL_INTERVAL seconds while there are subscribers.
+    """
+
+    def __init__(self, db: SQLite3, app: Optional[Flask] = None) -> None:
+        """Initializes the extension.
+
+        params:
+            db: The database extension holding the Feeds and FeedChanges tables.
+            app (optional): The Flask application to initialize the extension with.
+
+        """
+        self._db = db
+        self._subscriptions: dict[int, set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+        self._poller_pid = 0
+        self._origin = uuid.uuid4().hex
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension with the FEED_EVENTS_* settings of the app."""
+        app.extensions["feed_events"] = self
+        self._app = app
+        self.shared = bool(app.config.get("FEED_EVENTS_SHARED", True))
+        self.poll_interval = float(app.config.get("FEED_EVENTS_POLL_INTERVAL", 1))
+        self.retention = int(app.config.get("FEED_EVENTS_RETENTION", 300))
+        self.queue_size = int(app.config.get("FEED_EVENTS_QUEUE_SIZE", 100))
+
+    def record(self, db: sqlite3.Connection, kind: str, post_id: int) -> None:
+        """Writes a change to the FeedChanges table, for subscribers in other processes.
+
+        params:
+            db: The connection to write to. The caller is responsible for committing.
+            kind: The kind of change, "post" for a new post or "comments" for a new comment.
+            post_id: The id of the post that changed.
+
+        """
+        if self.shared:
+            record_change = """
+                INSERT INTO FeedChanges (origin, kind, p_id, creation_time)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP);
+            """
+            db.execute(record_change, (self._process_origin(), kind, post_id))
+
+    def publish(self, kind: str, post_id: int) -> None:
+        """Notifies the subscribers in this process whose timeline holds the post. Call it after committing."""
+        if self._subscriptions:
+            self._dispatch(self._db.connection, FeedEvent(kind, post_id))
+
+    @contextmanager
+    def subscribe(self, user_id: int) -> Iterator[Subscription]:
+        """Subscribes to the changes of a user's timeline for the duration of the with block."""
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        if self.shared:
+            self._start_poller()
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscriptions = self._subscriptions.get(user_id, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(user_id, None)
+
+    def _dispatch(self, db: sqlite3.Connection, event: FeedEvent) -> None:
+        """Puts the event in the subscriptions of every local subscriber whose timeline holds the post."""
+        readers = {row[0] for row in db.execute("SELECT u_id FROM Feeds WHERE p_id = ?;", (event.post_id,))}
+        with self._lock:
+            subscribed = readers & self._subscriptions.keys()
+            subscriptions = [subscription for user_id in subscribed for subscription in self._subscriptions[user_id]]
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def _process_origin(self) -> str:
+        """Returns the id of this process in the change log, which changes in a forked child."""
+        return f"{self._origin}-{os.getpid()}"
+
+    def _start_poller(self) -> None:
+        """Starts the thread polling the change log from its current end, unless it runs in this process already."""
+        with self._lock:
+            if self._poller is not None and self._poller_pid == os.getpid():
+                return
+            last_id = self._db.read("SELECT COALESCE(MAX(id), 0) FROM FeedChanges;", one=True)[0]
+            self._poller = threading.Thread(target=self._poll, args=(last_id,), name="feed-events", daemon=True)
+            self._poller_pid = os.getpid()
+            self._poller.start()
+
+    def _poll(self, last_id: int) -> None:
+        """Delivers the changes made by other processes until this process has no subscribers left."""
+        polls = 0
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._subscriptions:
+                    self._poller = None
+                    return
+            polls += 1
+            try:
+                with self._app.app_context():
+                    last_id = self._deliver(last_id)
+                    if polls % PRUNE_INTERVAL == 0:
+                        self._prune()
+            except sqlite3.Error:
+                logger.exception("Polling feed changes failed")
+
+    def _deliver(self, last_id: int) -> int:
+        """Dispatches the changes logged after last_id by other processes, returning the id of the last one."""
+        get_changes = "SELECT id, origin, kind, p_id FROM FeedChanges WHERE id > ? ORDER BY id LIMIT 1000;"
+        changes = self._db.read(get_changes, last_id)
+        origin = self._process_origin()
+        for change in changes:
+            if change["origin"] != origin:
+                self._dispatch(self._db.connection, FeedEvent(change["kind"], change["p_id"]))
+        return changes[-1]["id"] if changes else last_id
+
+    def _prune(self) -> None:
+        """Deletes the changes older than FEED_EVENTS_RETENTION seconds, which every process has seen by now."""
+        delete_old = "DELETE FROM FeedChanges WHERE creation_time < datetime('now', ?);"
+        with self._db.transaction() as db:
+            db.execute(delete_old, (f"-{self.retention} seconds",))
+
+
+def format_event(event: str, data: dict[str, Any]) -> str:
+    """Formats a Server-Sent Event with a compact JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
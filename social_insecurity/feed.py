@@ -0,0 +1,193 @@
+"""Provides the materialized feeds for the Social Insecurity application.
+
+Every user has a timeline in the Feeds table, holding one row per post that should appear on their stream.
+Rows are written when a post is created (fan-out on write) or when a friendship is added, so reading a
+timeline is a single range scan over the (u_id, creation_time, p_id) primary key.
+
+The number of comments on a post is kept in Posts.comment_count, which is incremented in the same
+transaction that inserts a comment, so the timeline does not count comments for every post it shows.
+
+Every timeline has a version in the FeedVersions table, which is bumped whenever a post is added to the
+timeline or a post on it gets a comment. Clients can revalidate a cached timeline by its version alone.
+
+Example:
+    from social_insecurity import sqlite
+    from social_insecurity.feed import fan_out_post, get_timeline
+
+    post_id = sqlite.connection.execute(insert_post, args).lastrowid
+    fan_out_post(sqlite.connection, post_id)
+    posts = get_timeline(sqlite.connection, user_id)
+"""
+
+import json
+import sqlite3
+from typing import Iterable, Optional
+
+from social_insecurity.pagination import FIRST_PAGE
+
+
+def fan_out_post(db: sqlite3.Connection, post_id: int, recipients: Optional[Iterable[int]] = None) -> int:
+    """Adds a post to the timelines of its author and everyone the author is friends with.
+
+    params:
+        db: The connection to write to. The caller is responsible for committing.
+        post_id: The id of the post to fan out.
+        recipients (optional): The ids of the users whose timelines get the post, e.g. from the friend graph.
+            Read from the Friends table if omitted.
+
+    returns: The number of timelines the post was added to.
+
+    """
+    if recipients is not None:
+        fan_out_to = """
+            INSERT OR IGNORE INTO Feeds (u_id, p_id, creation_time)
+            SELECT r.value, p.id, p.creation_time
+            FROM json_each(?) AS r, Posts AS p
+            WHERE p.id = ?;
+        """
+        rows = db.execute(fan_out_to, (json.dumps(sorted(recipients)), post_id)).rowcount
+        touch_post(db, post_id)
+        return rows
+
+    fan_out = """
+        WITH recipients(u_id) AS (
+            SELECT p.u_id FROM Posts AS p WHERE p.id = :post
+            UNION SELECT f.f_id FROM Friends AS f JOIN Posts AS p ON f.u_id = p.u_id WHERE p.id = :post
+            UNION SELECT f.u_id FROM Friends AS f JOIN Posts AS p ON f.f_id = p.u_id WHERE p.id = :post
+        )
+        INSERT OR IGNORE INTO Feeds (u_id, p_id, creation_time)
+        SELECT r.u_id, p.id, p.creation_time
+        FROM recipients AS r, Posts AS p
+        WHERE p.id = :post;
+    """
+    rows = db.execute(fan_out, {"post": post_id}).rowcount
+    touch_post(db, post_id)
+    return rows
+
+
+def touch_post(db: sqlite3.Connection, post_id: int) -> None:
+    """Bumps the version of every timeline the post is on, e.g. after it gets a comment.
+
+    params:
+        db: The connection to write to. The caller is responsible for committing.
+        post_id: The id of the post that changed.
+
+    """
+    bump_readers = """
+        INSERT INTO FeedVersions (u_id, version)
+        SELECT u_id, 1 FROM Feeds WHERE p_id = ?
+        ON CONFLICT (u_id) DO UPDATE SET version = version + 1;
+    """
+    db.execute(bump_readers, (post_id,))
+
+
+def connect_friends(db: sqlite3.Connection, user_id: int, friend_id: int) -> None:
+    """Adds the existing posts of two new friends to each other's timelines.
+
+    params:
+        db: The connection to write to. The caller is responsible for committing.
+        user_id: The id of the user who added the friend.
+        friend_id: The id of the friend that was added.
+
+    """
+    fan_in = """
+        INSERT OR IGNORE INTO Feeds (u_id, p_id, creation_time)
+        SELECT ?, id, creation_time FROM Posts WHERE u_id = ?;
+    """
+    db.execute(fan_in, (user_id, friend_id))
+    db.execute(fan_in, (friend_id, user_id))
+    bump_users = """
+        INSERT INTO FeedVersions (u_id, version) VALUES (?, 1), (?, 1)
+        ON CONFLICT (u_id) DO UPDATE SET version = version + 1;
+    """
+    db.execute(bump_users, (user_id, friend_id))
+
+
+def get_feed_version(db: sqlite3.Connection, user_id: int) -> int:
+    """Returns the version of a user's timeline, which changes whenever the posts on it or their counts do."""
+    row = db.execute("SELECT version FROM FeedVersions WHERE u_id = ?;", (user_id,)).fetchone()
+    return row[0] if row is not None else 0
+
+
+def get_timeline(
+    db: sqlite3.Connection, user_id: int, before: tuple[str, int] = FIRST_PAGE, limit: int = -1
+) -> list[sqlite3.Row]:
+    """Returns the posts on a user's timeline, newest first.
+
+    params:
+        db: The connection to read from.
+        user_id: The id of the user whose timeline is read.
+        before (optional): Only return posts whose (creation_time, id) sorts before this key.
+        limit (optional): The maximum number of posts to return. Returns all posts if negative.
+
+    returns: The posts with the username of their author and their comment count as cc.
+
+    """
+    get_posts = """
+        SELECT p.id, p.u_id, p.content, p.image, p.creation_time, p.comment_count AS cc, u.username
+        FROM Feeds AS f
+        JOIN Posts AS p ON p.id = f.p_id
+        JOIN Users AS u ON u.id = p.u_id
+        WHERE f.u_id = ? AND (f.creation_time, f.p_id) < (?, ?)
+        ORDER BY f.creation_time DESC, f.p_id DESC
+        LIMIT ?;
+    """
+    return db.execute(get_posts, (user_id, *before, limit)).fetchall()
+
+
+def rebuild_feeds(db: sqlite3.Connection, user_id: Optional[int] = None) -> int:
+    """Rebuilds timelines from the Posts and Friends tables.
+
+    params:
+        db: The connection to write to. The caller is responsible for committing.
+        user_id (optional): Only rebuild the timeline of this user. Rebuilds all timelines if omitted.
+
+    returns: The number of rows written to the Feeds table.
+
+    """
+    bump_versions = """
+        INSERT INTO FeedVersions (u_id, version) SELECT id, 1 FROM Users WHERE :user IS NULL OR id = :user
+        ON CONFLICT (u_id) DO UPDATE SET version = version + 1;
+    """
+    db.execute(bump_versions, {"user": user_id})
+
+    if user_id is not None:
+        db.execute("DELETE FROM Feeds WHERE u_id = ?;", (user_id,))
+        rebuild_user = """
+            INSERT INTO Feeds (u_id, p_id, creation_time)
+            SELECT :user, p.id, p.creation_time
+            FROM Posts AS p
+            WHERE p.u_id IN (
+                SELECT :user UNION SELECT f_id FROM Friends WHERE u_id = :user UNION SELECT u_id FROM Friends WHERE f_id = :user
+            );
+        """
+        return db.execute(rebuild_user, {"user": user_id}).rowcount
+
+    db.execute("DELETE FROM Feeds;")
+    rebuild_all = """
+        INSERT INTO Feeds (u_id, p_id, creation_time)
+        SELECT p.u_id, p.id, p.creation_time FROM Posts AS p
+        UNION SELECT f.f_id, p.id, p.creation_time FROM Posts AS p JOIN Friends AS f ON f.u_id = p.u_id
+        UNION SELECT f.u_id, p.id, p.creation_time FROM Posts AS p JOIN Friends AS f ON f.f_id = p.u_id;
+    """
+    return db.execute(rebuild_all).rowcount
+
+
+def reconcile_comment_counts(db: sqlite3.Connection) -> int:
+    """Recomputes Posts.comment_count from the Comments table, adding the column if the database predates it.
+
+    params:
+        db: The connection to write to. The caller is responsible for committing.
+
+    returns: The number of posts whose count was corrected.
+
+    """
+    columns = [column["name"] for column in db.execute("PRAGMA table_info(Posts);")]
+    if "comment_count" not in columns:
+        db.execute("ALTER TABLE Posts ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0;")
+    reconcile = """
+        UPDATE Posts
+        SET comment_count = (SELECT COUNT(*) FROM Comments WHERE p_id = Posts.id)
+        WHERE comment_count != (SELECT COUNT(*) FROM Comments WHERE p_id = Posts.id);
+    """
+    return db.execute(reconcile).rowcount
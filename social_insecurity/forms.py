@@ -25,6 +25,7 @@ from wtforms import (
     FileField,
     FormField,
     PasswordField,
+    SelectField,
     StringField,
     SubmitField,
     TextAreaField,
@@ -95,6 +96,17 @@ class FriendsForm(FlaskForm):
     submit = SubmitField(label="Add Friend")
 
 
+class SearchForm(FlaskForm):
+    """Provides the search form for the application. It is submitted with GET, so it has no CSRF token."""
+
+    class Meta:
+        csrf = False
+
+    q = StringField(label="Search", render_kw={"placeholder": "Search your friends' posts, comments and names"})
+    kind = SelectField(label="In", choices=[("posts", "Posts"), ("comments", "Comments"), ("people", "People")])
+    submit = SubmitField(label="Search")
+
+
 class ProfileForm(FlaskForm):
     """Provides the profile form for the application."""
 
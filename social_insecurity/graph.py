@@ -0,0 +1,110 @@
+"""Provides an in-memory index of the friend graph for the Social Insecurity application.
+
+The Friends table holds one row per friend a user added. The index keeps that graph as adjacency sets in both
+directions, so checking a friendship is O(1) and listing a user's friends or followers is O(degree), without a
+query. It is loaded on first use in each process and kept current by reading the rows added since the last
+load, by rowid, at most once per request. Rows are only ever added to Friends; after deleting rows, call
+reload().
+
+Example:
+    from social_insecurity import friend_graph
+
+    if not friend_graph.is_friend(user_id, friend_id):
+        ...
+    recipients = friend_graph.neighbours(user_id)
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from threading import Lock
+from typing import Optional
+
+from flask import Flask, g, has_app_context
+
+from social_insecurity.database import SQLite3
+
+
+class FriendGraph:
+    """Provides bidirectional adjacency sets of the Friends table, synced lazily from the database."""
+
+    def __init__(self, db: SQLite3, app: Optional[Flask] = None) -> None:
+        """Initializes the extension.
+
+        params:
+            db: The database extension to read friendships from.
+            app (optional): The Flask application to initialize the extension with.
+
+        """
+        self._db = db
+        self._lock = Lock()
+        self.reload()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension."""
+        app.extensions["friend_graph"] = self
+
+    def friends(self, user_id: int) -> frozenset[int]:
+        """Returns the ids of the users the user added as friends."""
+        self._sync_once()
+        return frozenset(self._friends.get(user_id, ()))
+
+    def followers(self, user_id: int) -> frozenset[int]:
+        """Returns the ids of the users who added the user as a friend."""
+        self._sync_once()
+        return frozenset(self._followers.get(user_id, ()))
+
+    def neighbours(self, user_id: int) -> frozenset[int]:
+        """Returns the ids of the users connected to the user in either direction, whose posts share timelines."""
+        self._sync_once()
+        return frozenset(self._friends.get(user_id, ())) | self._followers.get(user_id, set())
+
+    def is_friend(self, user_id: int, friend_id: int) -> bool:
+        """Checks whether the user added the other user as a friend."""
+        self._sync_once()
+        return friend_id in self._friends.get(user_id, ())
+
+    def add(self, user_id: int, friend_id: int) -> None:
+        """Adds a friendship that was just inserted into the Friends table."""
+        with self._lock:
+            self._add(user_id, friend_id)
+
+    def sync(self, db: Optional[sqlite3.Connection] = None) -> int:
+        """Reads the friendships added since the last sync.
+
+        params:
+            db (optional): The connection to read from, e.g. one inside a write transaction, so that no
+                friendship committed before the transaction began is missed.
+
+        returns: The number of friendships read.
+
+        """
+        db = db or self._db.connection
+        with self._lock:
+            get_new = "SELECT rowid, u_id, f_id FROM Friends WHERE rowid > ? ORDER BY rowid;"
+            rows = db.execute(get_new, (self._last_rowid,)).fetchall()
+            for rowid, user_id, friend_id in rows:
+                self._add(user_id, friend_id)
+                self._last_rowid = rowid
+        return len(rows)
+
+    def reload(self) -> None:
+        """Drops the index, so that it is loaded again on next use."""
+        with self._lock:
+            self._friends: dict[int, set[int]] = {}
+            self._followers: dict[int, set[int]] = {}
+            self._last_rowid = 0
+
+    def _add(self, user_id: int, friend_id: int) -> None:
+        self._friends.setdefault(user_id, set()).add(friend_id)
+        self._followers.setdefault(friend_id, set()).add(user_id)
+
+    def _sync_once(self) -> None:
+        """Syncs the index at most once per request or application context."""
+        if not has_app_context():
+            return
+        if not g.get("friend_graph_synced"):
+            self.sync()
+            g.friend_graph_synced = True
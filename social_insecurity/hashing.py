@@ -0,0 +1,123 @@
+"""Provides password hashing for the Social Insecurity application.
+
+Hashing a password with bcrypt takes hundreds of milliseconds of CPU time, so the work is sent to a pool of
+worker processes instead of running on the thread serving the request. The number of hashes that may wait for
+a worker is bounded, and requests beyond that are answered with 503 Service Unavailable.
+
+Example:
+    from social_insecurity import passwords
+
+    pw_hash = passwords.hash("Hunter2!")
+    if passwords.check(pw_hash, "Hunter2!") and passwords.needs_rehash(pw_hash):
+        pw_hash = passwords.hash("Hunter2!")
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing.context import BaseContext
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable, Optional
+
+import bcrypt
+from flask import Flask
+from werkzeug.exceptions import ServiceUnavailable
+
+
+def hash_password(password: str, rounds: int) -> str:
+    """Hashes the password with bcrypt using 2^rounds iterations."""
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+
+def check_password(pw_hash: str, password: str) -> bool:
+    """Checks the password against a bcrypt hash. Returns False if the hash is not a bcrypt hash."""
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), pw_hash.encode("utf-8"))
+    except ValueError:
+        return False
+
+
+def hash_rounds(pw_hash: str) -> Optional[int]:
+    """Returns the cost factor of a bcrypt hash, or None if it is not a bcrypt hash."""
+    parts = pw_hash.split("$")
+    if len(parts) != 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def worker_context() -> BaseContext:
+    """Returns the multiprocessing context for hashing workers.
+
+    Workers are started from a fork server rather than forked from the threaded web server.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+class PasswordHasher:
+    """Provides bcrypt hashing in a bounded pool of worker processes.
+
+    The pool is started on first use. With PASSWORD_HASHER_WORKERS set to 0 hashing runs on the calling thread.
+    """
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        """Initializes the extension.
+
+        params:
+            app (optional): The Flask application to initialize the extension with.
+
+        """
+        self._executor: Optional[Executor] = None
+        self._executor_lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension with the BCRYPT_LOG_ROUNDS and PASSWORD_HASHER_* settings of the app."""
+        app.extensions["password_hasher"] = self
+        self.rounds = int(app.config.get("BCRYPT_LOG_ROUNDS", 12))
+        self.workers = app.config.get("PASSWORD_HASHER_WORKERS")
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+        self.max_pending = int(app.config.get("PASSWORD_HASHER_MAX_PENDING") or 4 * max(self.workers, 1))
+        self.timeout = float(app.config.get("PASSWORD_HASHER_TIMEOUT", 5))
+        self._slots = BoundedSemaphore(self.max_pending)
+
+    def hash(self, password: str) -> str:
+        """Returns a bcrypt hash of the password using the configured number of rounds."""
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, pw_hash: str, password: str) -> bool:
+        """Checks whether the password matches the bcrypt hash."""
+        return self._run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash: str) -> bool:
+        """Checks whether the hash was made with a different number of rounds than the configured one."""
+        return hash_rounds(pw_hash) != self.rounds
+
+    def shutdown(self) -> None:
+        """Stops the worker processes. They are started again on the next hash."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Runs the function in the pool, waiting for a free slot for at most PASSWORD_HASHER_TIMEOUT seconds."""
+        if not self.workers:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ServiceUnavailable("The server is busy, please try again shortly.", retry_after=1)
+        try:
+            return self._pool().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def _pool(self) -> Executor:
+        """Returns the pool of worker processes, starting it if needed."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=worker_context())
+            return self._executor
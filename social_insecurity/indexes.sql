@@ -0,0 +1,21 @@
+-- --
+-- Create secondary indexes
+--
+-- Applied on every start, so indexes added here also reach existing databases.
+-- The query plan tests in tests/test_query_plans.py fail if a hot query needs an index that is missing.
+-- --
+
+-- Posts by author, for fanning out the posts of new friends into each other's feeds
+CREATE INDEX IF NOT EXISTS [posts_u_id_creation_time] ON [Posts](u_id, creation_time, id);
+
+-- Comments on a post, newest first, for the comments page and the comment count on the stream
+CREATE INDEX IF NOT EXISTS [comments_p_id_creation_time] ON [Comments](p_id, creation_time, id);
+
+-- Comments by author
+CREATE INDEX IF NOT EXISTS [comments_u_id] ON [Comments](u_id);
+
+-- Reverse friendships, for users who added someone as a friend
+CREATE INDEX IF NOT EXISTS [friends_f_id_u_id] ON [Friends](f_id, u_id);
+
+-- Timelines a post is on, for bumping their versions when the post gets a comment
+CREATE INDEX IF NOT EXISTS [feeds_p_id] ON [Feeds](p_id);
@@ -0,0 +1,67 @@
+"""Provides the metrics of the Social Insecurity application in the Prometheus text format.
+
+The figures are kept per process, so with several worker processes every scrape sees the worker that answered
+it. Scrape each worker, or sum up the scrapes, to get the figures of the whole application.
+
+Example:
+    from social_insecurity import sqlite
+    from social_insecurity.metrics import render_metrics
+
+    return Response(render_metrics(sqlite), mimetype=METRICS_MIMETYPE)
+"""
+
+from typing import Optional
+
+from social_insecurity.database import SQLite3
+from social_insecurity.writer import WriteQueue
+
+METRICS_MIMETYPE = "text/plain; version=0.0.4"
+
+
+def render_metrics(db: SQLite3, write_queue: Optional[WriteQueue] = None) -> str:
+    """Renders the statement totals by endpoint, the slow query count, the connection pool and write queue figures."""
+    totals = sorted(db.query_totals.items())
+    pool = db.pool_stats
+    lines = [
+        "# HELP http_requests_total Requests served, by endpoint.",
+        "# TYPE http_requests_total counter",
+        *(f'http_requests_total{{endpoint="{endpoint}"}} {total.requests}' for endpoint, total in totals),
+        "# HELP sqlite3_queries_total Statements run by requests, by endpoint.",
+        "# TYPE sqlite3_queries_total counter",
+        *(f'sqlite3_queries_total{{endpoint="{endpoint}"}} {total.queries}' for endpoint, total in totals),
+        "# HELP sqlite3_query_seconds_total Time spent running the statements of requests, by endpoint.",
+        "# TYPE sqlite3_query_seconds_total counter",
+        *(f'sqlite3_query_seconds_total{{endpoint="{endpoint}"}} {total.duration:.6f}' for endpoint, total in totals),
+        "# HELP sqlite3_slow_queries_total Statements that took longer than SQLITE3_SLOW_QUERY_MS.",
+        "# TYPE sqlite3_slow_queries_total counter",
+        f"sqlite3_slow_queries_total {db.slow_queries}",
+        "# HELP sqlite3_pool_connections Connections the pool keeps, and how many of them are idle.",
+        "# TYPE sqlite3_pool_connections gauge",
+        f'sqlite3_pool_connections{{state="size"}} {pool["size"]}',
+        f'sqlite3_pool_connections{{state="idle"}} {pool["idle"]}',
+        "# HELP sqlite3_pool_acquires_total Connections taken from the pool, or opened because it was empty.",
+        "# TYPE sqlite3_pool_acquires_total counter",
+        f'sqlite3_pool_acquires_total{{result="hit"}} {pool["hits"]}',
+        f'sqlite3_pool_acquires_total{{result="miss"}} {pool["misses"]}',
+    ]
+    if write_queue is not None:
+        stats = write_queue.stats
+        buckets, count = [], 0
+        for bound, batches in stats["batch_sizes"].items():
+            count += batches
+            le = "+Inf" if bound == float("inf") else bound
+            buckets.append(f'write_queue_batch_size_bucket{{le="{le}"}} {count}')
+        lines += [
+            "# HELP write_queue_depth Writes waiting for the writer thread.",
+            "# TYPE write_queue_depth gauge",
+            f"write_queue_depth {stats['depth']}",
+            "# HELP write_queue_batch_size Writes committed together.",
+            "# TYPE write_queue_batch_size histogram",
+            *buckets,
+            f"write_queue_batch_size_sum {stats['writes']}",
+            f"write_queue_batch_size_count {stats['batches']}",
+            "# HELP write_queue_commit_seconds_total Time spent running and committing batches.",
+            "# TYPE write_queue_commit_seconds_total counter",
+            f"write_queue_commit_seconds_total {stats['commit_seconds']:.6f}",
+        ]
+    return "\n".join(lines) + "\n"
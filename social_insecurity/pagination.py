@@ -0,0 +1,62 @@
+"""Provides keyset pagination helpers for the Social Insecurity application.
+
+Pages are ordered by (creation_time, id) descending. A cursor encodes the key of the last row on a page,
+and the next page is fetched with a range condition on that key, so every page costs the same to read
+no matter how deep the reader has scrolled.
+
+Example:
+    from social_insecurity.pagination import decode_cursor, paginate
+
+    before = decode_cursor(request.args.get("cursor"))
+    rows = db.execute(query, (*before, page_size + 1)).fetchall()
+    rows, next_cursor = paginate(rows, page_size)
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Optional, Sequence
+
+from flask import abort
+
+# Sorts after every timestamp written by CURRENT_TIMESTAMP and every rowid
+FIRST_PAGE = ("9999-12-31 23:59:59", 2**63 - 1)
+
+
+def encode_cursor(creation_time: str, id: int) -> str:
+    """Encodes the key of a row as an opaque, URL safe cursor."""
+    return urlsafe_b64encode(f"{creation_time}|{id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> tuple[str, int]:
+    """Decodes a cursor into a (creation_time, id) key, aborting with 400 if it is malformed.
+
+    params:
+        cursor: The cursor from the request, or None for the first page.
+
+    returns: The key that all rows on the requested page sort before.
+
+    """
+    if not cursor:
+        return FIRST_PAGE
+    try:
+        creation_time, id = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().rsplit("|", 1)
+        return creation_time, int(id)
+    except ValueError:
+        abort(400)
+
+
+def paginate(rows: Sequence, page_size: int, id_column: str = "id") -> tuple[list, Optional[str]]:
+    """Splits a result fetched with LIMIT page_size + 1 into a page and the cursor of the next page.
+
+    params:
+        rows: The rows, ordered by (creation_time, id) descending.
+        page_size: The number of rows on a page.
+        id_column (optional): The name of the id column in the rows.
+
+    returns: The rows on the page and the cursor of the next page, or None if this is the last page.
+
+    """
+    page = list(rows[:page_size])
+    if len(rows) <= page_size:
+        return page, None
+    last = page[-1]
+    return page, encode_cursor(last["creation_time"], last[id_column])
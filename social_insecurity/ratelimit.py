@@ -0,0 +1,192 @@
+"""Provides a rate limit storage for the Social Insecurity application that is shared between worker processes.
+
+Counters are kept in a small SQLite database of their own, next to the application database, so every worker
+process on the host sees the same counts without an outside service such as Redis. The storage implements the
+sliding window counter strategy, which keeps two counters per key: the current and the previous window. The
+previous count is weighted by how much of its window still overlaps the sliding window, so memory per key is
+constant while bursts at window edges are smoothed out.
+
+Importing this module registers the sqlite:// storage scheme with the limits library.
+
+Example:
+    RATELIMIT_STORAGE_URI = "sqlite:////srv/social-insecurity/instance/ratelimit.db"
+    RATELIMIT_STRATEGY = "sliding-window-counter"
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from math import floor
+from typing import Any
+from urllib.parse import urlparse
+
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+# Delete expired counters after this many increments in a process
+PURGE_INTERVAL = 1000
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """Provides rate limit counters in an SQLite database, safe to share between threads and processes.
+
+    Every change runs in its own IMMEDIATE transaction, so checking and incrementing a window is atomic across
+    processes. Connections are opened on first use in each thread, and opened again in a forked child.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options: Any) -> None:
+        """Initializes the storage.
+
+        params:
+            uri: The URI of the database file, e.g. sqlite:////tmp/ratelimit.db.
+            wrap_exceptions (optional): Whether to wrap database errors in limits.errors.StorageError.
+
+        """
+        self._path = urlparse(uri).path
+        self._timeout = float(options.get("timeout", 5))
+        self._local = threading.local()
+        self._increments = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        # The connection is closed again, so that no connection is inherited by worker processes forked later
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS Limits ("
+                "  key TEXT PRIMARY KEY, count INTEGER NOT NULL, expiry REAL NOT NULL"
+                ") WITHOUT ROWID;"
+            )
+        finally:
+            conn.close()
+
+    @property
+    def base_exceptions(self) -> type[Exception]:
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        """Increments the counter of the key, starting a new one that expires in expiry seconds if needed."""
+        with self._transaction() as db:
+            return self._incr(db, key, expiry, amount, time.time())
+
+    def decr(self, key: str, amount: int = 1) -> int:
+        """Decrements the counter of the key, without going below 0."""
+        with self._transaction() as db:
+            db.execute("UPDATE Limits SET count = max(count - ?, 0) WHERE key = ?;", (amount, key))
+            return self._get(db, key, time.time())
+
+    def get(self, key: str) -> int:
+        """Returns the counter of the key, or 0 if it has expired."""
+        return self._get(self._connection(), key, time.time())
+
+    def get_expiry(self, key: str) -> float:
+        """Returns the time the counter of the key expires at."""
+        row = self._connection().execute("SELECT expiry FROM Limits WHERE key = ?;", (key,)).fetchone()
+        return row[0] if row is not None else time.time()
+
+    def check(self) -> bool:
+        """Checks whether the database can be read."""
+        try:
+            self._connection().execute("SELECT 1;")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> int:
+        """Deletes all counters and returns how many there were."""
+        with self._transaction() as db:
+            return db.execute("DELETE FROM Limits;").rowcount
+
+    def clear(self, key: str) -> None:
+        """Deletes the counter of the key."""
+        with self._transaction() as db:
+            db.execute("DELETE FROM Limits WHERE key = ?;", (key,))
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        """Counts a hit if the weighted count of the current and previous windows stays within the limit."""
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        with self._transaction() as db:
+            previous_count, previous_ttl, current_count, _ = self._window(db, previous_key, current_key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            self._incr(db, current_key, 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key: str, expiry: int) -> tuple[int, float, int, float]:
+        """Returns the count and time to live of the previous and current windows."""
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        return self._window(self._connection(), previous_key, current_key, expiry, now)
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        """Deletes the counters of the previous and current windows."""
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        with self._transaction() as db:
+            db.execute("DELETE FROM Limits WHERE key IN (?, ?);", (previous_key, current_key))
+
+    def _window(
+        self, db: sqlite3.Connection, previous_key: str, current_key: str, expiry: int, now: float
+    ) -> tuple[int, float, int, float]:
+        """Returns the count and time to live of the previous and current windows, like the memory storage."""
+        previous_count = self._get(db, previous_key, now)
+        current_count = self._get(db, current_key, now)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def _get(self, db: sqlite3.Connection, key: str, now: float) -> int:
+        """Returns the counter of the key, or 0 if it has expired."""
+        row = db.execute("SELECT count FROM Limits WHERE key = ? AND expiry > ?;", (key, now)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _incr(self, db: sqlite3.Connection, key: str, expiry: float, amount: int, now: float) -> int:
+        """Increments a counter inside the caller's transaction, purging expired counters now and then."""
+        increment = """
+            INSERT INTO Limits (key, count, expiry) VALUES (:key, :amount, :expires)
+            ON CONFLICT (key) DO UPDATE SET
+                count = CASE WHEN expiry > :now THEN count + :amount ELSE :amount END,
+                expiry = CASE WHEN expiry > :now THEN expiry ELSE :expires END
+            RETURNING count;
+        """
+        count = db.execute(increment, {"key": key, "amount": amount, "expires": now + expiry, "now": now}).fetchone()
+        self._increments += 1
+        if self._increments % PURGE_INTERVAL == 0:
+            db.execute("DELETE FROM Limits WHERE expiry <= ?;", (now,))
+        return count[0]
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread, opening a new one in a forked child."""
+        conn = getattr(self._local, "connection", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.connection = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a connection in autocommit mode, so that transactions are begun explicitly."""
+        conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Runs the statements of the with block in an IMMEDIATE transaction, rolling back if the block raises."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+            raise
+        conn.execute("COMMIT;")
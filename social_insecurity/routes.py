@@ -4,33 +4,50 @@ This file contains the routes for the application. It is imported by the social_
 It also contains the SQL queries used for communicating with the database.
 """
 
+import json
 import sqlite3
+from time import monotonic
+from typing import Callable, Optional
 from pathlib import Path
-from werkzeug.utils import secure_filename
-import uuid
 from pathlib import Path
 # import os
 # from dotenv import load_dotenv
 from flask import current_app as app
-from flask import flash, redirect, render_template, send_from_directory, url_for
+from flask import Response, abort, flash, jsonify, redirect, render_template, request, stream_with_context, url_for
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_login import current_user, login_required, login_user, logout_user
 
-from social_insecurity import sqlite
+from social_insecurity import (
+    feed_events,
+    fragment_cache,
+    friend_graph,
+    passwords,
+    sqlite,
+    upload_store,
+    user_cache,
+    write_queue,
+)
+from social_insecurity.archive import find_archived_post, get_archived_comments, get_timeline_page
 from social_insecurity.config import *
 from social_insecurity.database import User
-from social_insecurity.forms import CommentsForm, FriendsForm, IndexForm, PostForm, ProfileForm
+from social_insecurity.events import OVERFLOW, FeedEvent, format_event
+from social_insecurity.feed import connect_friends, fan_out_post, get_feed_version, touch_post
+from social_insecurity.forms import CommentsForm, FriendsForm, IndexForm, PostForm, ProfileForm, SearchForm
+from social_insecurity.metrics import METRICS_MIMETYPE, render_metrics
+from social_insecurity.pagination import decode_cursor, paginate
+from social_insecurity.search import match_query, search
+from social_insecurity.ratelimit import SQLiteStorage  # noqa: F401, registers the sqlite:// storage scheme
 from social_insecurity.utils import *
-from . import bcrypt
 
 # load_dotenv()
 
+if not app.config.get("RATELIMIT_STORAGE_URI"):
+    app.config["RATELIMIT_STORAGE_URI"] = f"sqlite:///{Path(app.instance_path) / 'ratelimit.db'}"
 limiter = Limiter(get_remote_address, app=app)
 
 @app.route("/", methods=["GET", "POST"])
 @app.route("/index", methods=["GET", "POST"])
-@limiter.limit("1000 per day")
 def index():
     """Provides the index page for the application.
 
@@ -50,7 +67,7 @@ def index():
 
     if login_form.is_submitted() and login_form.submit.data:
         get_user = "SELECT * FROM Users WHERE username = ?;"
-        user = sqlite.query(get_user, login_form.username.data, one=True)
+        user = sqlite.read(get_user, login_form.username.data, one=True)
 
         if user is None:
             flash("Invalid username or password!", category="warning")
@@ -61,18 +78,21 @@ def index():
                 password = user["password"]
             )
 
-            if not bcrypt.check_password_hash(user_data.password, login_form.password.data):
+            if not passwords.check(user_data.password, login_form.password.data):
                 flash("Invalid username or password!", category="warning")
             else:
+                if passwords.needs_rehash(user_data.password):
+                    rehash_password = "UPDATE Users SET password = ? WHERE id = ?;"
+                    sqlite.write(rehash_password, passwords.hash(login_form.password.data), user_data.id)
+                    user_cache.invalidate(user_data.id)
                 login_user(user_data, remember=login_form.remember_me.data)
                 return redirect(url_for("stream"))
 
     elif register_form.validate_on_submit():
-        password_hashed = bcrypt.generate_password_hash(register_form.password.data).decode("utf-8")
         check_user = """
             SELECT id FROM Users WHERE username = ?;
         """
-        existing_user = sqlite.query(
+        existing_user = sqlite.read(
             check_user,
             register_form.username.data
         )
@@ -80,11 +100,12 @@ def index():
         if existing_user:
             flash("Username already taken. Please choose a different username.", category="warning")
         else:
+            password_hashed = passwords.hash(register_form.password.data)
             insert_user = """
                 INSERT INTO Users (username, first_name, last_name, password)
                 VALUES (?, ?, ?, ?);
             """
-            sqlite.query(
+            sqlite.write(
                 insert_user,
                 register_form.username.data,
                 register_form.first_name.data,
@@ -107,29 +128,25 @@ def stream():
     Otherwise, it reads the username from the URL and displays all posts from the user and their friends.
     """
     username = current_user.username
-    get_user = "SELECT * FROM Users WHERE username = ?;"
-    user = sqlite.query(get_user, username, one=True)
 
     if not current_user.is_authenticated:
         flash("User not found", category="warning")
         return redirect(url_for('index'))
     
     post_form = PostForm()
-    get_user = "SELECT * FROM Users WHERE username = ?;"
-    user = sqlite.query(get_user, username, one=True)
+    user = user_cache.get(current_user.id)
 
     if post_form.is_submitted():
         image_filename = None
         if post_form.image.data:
             file = post_form.image.data
             filename = file.filename
-            if allowed_file(filename) and allowed_mime_type(file.stream):
-                unique_filename = f"{uuid.uuid4().hex}_{secure_filename(filename)}"
-                upload_path = Path(app.instance_path) / app.config["UPLOADS_FOLDER_PATH"] / unique_filename
+            stored = None
+            if allowed_file(filename):
+                stored = upload_store.save(file, filename.rsplit(".", 1)[1])
 
-                file.save(upload_path)
-
-                image_filename = unique_filename
+            if stored is not None:
+                image_filename = stored.filename
             else:
                 flash("Invalid file type or format!", category="warning")
                 return redirect(url_for("stream"))
@@ -138,19 +155,88 @@ def stream():
             INSERT INTO Posts (u_id, content, image, creation_time)
             VALUES (?, ?, ?, CURRENT_TIMESTAMP);
         """
-        sqlite.query(insert_post, user["id"], post_form.content.data, image_filename)
+        content = post_form.content.data
+
+        def write_post(db: sqlite3.Connection) -> int:
+            post_id = db.execute(insert_post, (user["id"], content, image_filename)).lastrowid
+            friend_graph.sync(db)
+            fan_out_post(db, post_id, friend_graph.neighbours(user["id"]) | {user["id"]})
+            feed_events.record(db, "post", post_id)
+            return post_id
+
+        post_id = write_queue.run(write_post)
+        fragment_cache.invalidate("post_card.html.j2", post_id)
+        feed_events.publish("post", post_id)
         return redirect(url_for("stream"))
 
-    get_posts = """
-        SELECT p.*, u.*, (SELECT COUNT(*) FROM Comments WHERE p_id = p.id) AS cc
+    posts, next_cursor = get_stream_page(user["id"])
+    return render_template(
+        "stream.html.j2", title="Stream", username=username, form=post_form, posts=posts, next_cursor=next_cursor
+    )
+
+
+@app.route("/stream/more")
+@login_required
+def stream_more():
+    """Provides the next page of the stream as an HTML fragment, for the "Load more" link."""
+    user = user_cache.get(current_user.id)
+    posts, next_cursor = get_stream_page(user["id"])
+    return render_template("post_page.html.j2", posts=posts, next_cursor=next_cursor)
+
+
+@app.route("/stream/events")
+@login_required
+def stream_events():
+    """Provides the changes to the user's timeline as Server-Sent Events, for live updates of the stream.
+
+    New posts are sent as "post" events with their rendered card, and new comments as "comments" events with
+    the new comment count. The connection is closed after FEED_EVENTS_MAX_DURATION seconds and the browser
+    reconnects, so a worker thread is not held forever.
+    """
+    user = user_cache.get(current_user.id)
+    keepalive = app.config["FEED_EVENTS_KEEPALIVE"]
+    max_duration = app.config["FEED_EVENTS_MAX_DURATION"]
+
+    @stream_with_context
+    def events():
+        with feed_events.subscribe(user["id"]) as subscription:
+            yield "retry: 3000\n\n"
+            deadline = monotonic() + max_duration
+            while monotonic() < deadline:
+                event = subscription.get(timeout=keepalive)
+                if event is None:
+                    yield ": keepalive\n\n"
+                elif event is OVERFLOW:
+                    yield format_event("reset", {})
+                    return
+                else:
+                    yield render_feed_event(event)
+
+    response = app.response_class(events(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def render_feed_event(event: FeedEvent) -> str:
+    """Formats a change to the timeline as a Server-Sent Event."""
+    get_post = """
+        SELECT p.id, p.u_id, p.content, p.image, p.creation_time, p.comment_count AS cc, u.username
         FROM Posts AS p JOIN Users AS u ON u.id = p.u_id
-        WHERE p.u_id IN (SELECT u_id FROM Friends WHERE f_id = ?)
-           OR p.u_id IN (SELECT f_id FROM Friends WHERE u_id = ?)
-           OR p.u_id = ?
-        ORDER BY p.creation_time DESC;
+        WHERE p.id = ?;
     """
-    posts = sqlite.query(get_posts, user["id"], user["id"], user["id"])
-    return render_template("stream.html.j2", title="Stream", username=username, form=post_form, posts=posts)
+    post = sqlite.read(get_post, event.post_id, one=True)
+    if event.kind == "post":
+        html = fragment_cache.render("post_card.html.j2", post["id"], post["cc"], post=post)
+        return format_event("post", {"id": post["id"], "html": html})
+    return format_event("comments", {"id": post["id"], "comments": post["cc"]})
+
+
+def get_stream_page(user_id: int):
+    """Reads the page of the user's timeline that starts at the cursor in the request, from the archives past it."""
+    page_size = app.config["FEED_PAGE_SIZE"]
+    before = decode_cursor(request.args.get("cursor"))
+    return get_timeline_page(sqlite.connection, user_id, before, page_size)
 
 
 @app.route("/comments/<int:post_id>", methods=["GET", "POST"])
@@ -167,32 +253,153 @@ def comments(post_id: int):
     Otherwise, it reads the username and post id from the URL and displays all comments for the post.
     """
     comments_form = CommentsForm()
-    get_user = "SELECT * FROM Users WHERE username = ?;"
-    user = sqlite.query(get_user, username, one=True)
-
-    if comments_form.is_submitted():
-        insert_comment = """
-            INSERT INTO Comments (p_id, u_id, comment, creation_time)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP);
-        """
-        sqlite.query(insert_comment, post_id, user["id"], comments_form.comment.data)
-
+    user = user_cache.get(current_user.id)
     get_post = """
         SELECT *
         FROM Posts AS p JOIN Users AS u ON p.u_id = u.id
         WHERE p.id = ?;
     """
+    post = sqlite.read(get_post, post_id, one=True)
+    archive = None
+    if post is None:
+        archive, post = find_archived_post(sqlite.connection, post_id)
+
+    if comments_form.is_submitted() and (post is None or archive is not None):
+        flash("Archived posts cannot be commented on.", category="warning")
+    elif comments_form.is_submitted():
+        insert_comment = """
+            INSERT INTO Comments (p_id, u_id, comment, creation_time)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP);
+        """
+        increment_count = "UPDATE Posts SET comment_count = comment_count + 1 WHERE id = ?;"
+        comment = comments_form.comment.data
+
+        def write_comment(db: sqlite3.Connection) -> None:
+            db.execute(insert_comment, (post_id, user["id"], comment))
+            db.execute(increment_count, (post_id,))
+            touch_post(db, post_id)
+            feed_events.record(db, "comments", post_id)
+
+        write_queue.run(write_comment)
+        fragment_cache.invalidate("post_card.html.j2", post_id)
+        feed_events.publish("comments", post_id)
+
+    comments, next_cursor = get_comments_page(post_id, archive)
+    return render_template(
+        "comments.html.j2",
+        title="Comments",
+        username=username,
+        form=comments_form,
+        post=post,
+        post_id=post_id,
+        archived=archive is not None,
+        comments=comments,
+        next_cursor=next_cursor,
+    )
+
+
+@app.route("/comments/<int:post_id>/more")
+@login_required
+def comments_more(post_id: int):
+    """Provides the next page of comments on a post as an HTML fragment, for the "Load more" link."""
+    archive = None
+    if sqlite.read("SELECT 1 FROM Posts WHERE id = ?;", post_id, one=True) is None:
+        archive, _ = find_archived_post(sqlite.connection, post_id)
+    comments, next_cursor = get_comments_page(post_id, archive)
+    return render_template("comment_page.html.j2", post_id=post_id, comments=comments, next_cursor=next_cursor)
+
+
+def get_comments_page(post_id: int, archive: Optional[str] = None):
+    """Reads the page of comments on the post that starts at the cursor in the request, from its archive if any."""
+    page_size = app.config["FEED_PAGE_SIZE"]
+    before = decode_cursor(request.args.get("cursor"))
+    if archive is not None:
+        comments = get_archived_comments(sqlite.connection, archive, post_id, before, page_size + 1)
+        return paginate(comments, page_size)
     get_comments = """
-        SELECT DISTINCT *
+        SELECT c.id, c.comment, c.creation_time, u.username
         FROM Comments AS c JOIN Users AS u ON c.u_id = u.id
-        WHERE c.p_id = ?
-        ORDER BY c.creation_time DESC;
+        WHERE c.p_id = ? AND (c.creation_time, c.id) < (?, ?)
+        ORDER BY c.creation_time DESC, c.id DESC
+        LIMIT ?;
     """
-    post = sqlite.query(get_post, post_id, one=True)
-    comments = sqlite.query(get_comments, post_id)
-    return render_template(
-        "comments.html.j2", title="Comments", username=username, form=comments_form, post=post, comments=comments
-    )
+    comments = sqlite.read(get_comments, post_id, *before, page_size + 1)
+    return paginate(comments, page_size)
+
+
+@app.route("/api/stream")
+@login_required
+def api_stream():
+    """Provides a page of the stream as JSON, for the mobile clients.
+
+    The ETag is made from the version of the user's timeline, so revalidating an unchanged page costs one lookup.
+    """
+    user = user_cache.get(current_user.id)
+    version = get_feed_version(sqlite.connection, user["id"])
+    etag = f"stream-{user['id']}-{version}-{request.args.get('cursor', '')}"
+
+    def load_page() -> dict:
+        posts, next_cursor = get_stream_page(user["id"])
+        return {
+            "posts": [
+                {
+                    "id": post["id"],
+                    "author": post["username"],
+                    "content": post["content"],
+                    "image": url_for("uploads", filename=post["image"]) if post["image"] else None,
+                    "created": post["creation_time"],
+                    "comments": post["cc"],
+                }
+                for post in posts
+            ],
+            "next_cursor": next_cursor,
+        }
+
+    return conditional_json(etag, load_page)
+
+
+@app.route("/api/comments/<int:post_id>")
+@login_required
+def api_comments(post_id: int):
+    """Provides a page of the comments on a post as JSON.
+
+    Comments are only ever added, so the ETag is made from the comment count of the post.
+    """
+    post = sqlite.read("SELECT comment_count FROM Posts WHERE id = ?;", post_id, one=True)
+    archive = None
+    if post is None:
+        archive, post = find_archived_post(sqlite.connection, post_id)
+    if post is None:
+        abort(404)
+    etag = f"comments-{post_id}-{post['comment_count']}-{request.args.get('cursor', '')}"
+
+    def load_page() -> dict:
+        comments, next_cursor = get_comments_page(post_id, archive)
+        return {
+            "comments": [
+                {
+                    "id": comment["id"],
+                    "author": comment["username"],
+                    "comment": comment["comment"],
+                    "created": comment["creation_time"],
+                }
+                for comment in comments
+            ],
+            "next_cursor": next_cursor,
+        }
+
+    return conditional_json(etag, load_page)
+
+
+def conditional_json(etag: str, load: Callable[[], dict]) -> Response:
+    """Returns the JSON body made by load, or 304 Not Modified without calling load if the client has the ETag."""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(load())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @app.route("/friends", methods=["GET", "POST"])
@@ -208,35 +415,71 @@ def friends():
     Otherwise, it reads the username from the URL and displays all friends of the user.
     """
     friends_form = FriendsForm()
-    get_user = "SELECT * FROM Users WHERE username = ?;"
-    user = sqlite.query(get_user, username, one=True)
+    user = user_cache.get(current_user.id)
 
     if friends_form.is_submitted():
         get_friend = "SELECT * FROM Users WHERE username = ?;"
-        friend = sqlite.query(get_friend, friends_form.username.data, one=True)
-        get_friends = "SELECT f_id FROM Friends WHERE u_id = ?;"
-        friends = sqlite.query(get_friends, user["id"])
+        friend = sqlite.read(get_friend, friends_form.username.data, one=True)
 
         if friend is None:
             flash("User does not exist!", category="warning")
         elif friend["id"] == user["id"]:
             flash("You cannot be friends with yourself!", category="warning")
-        elif friend["id"] in [friend["f_id"] for friend in friends]:
+        elif friend_graph.is_friend(user["id"], friend["id"]):
             flash("You are already friends with this user!", category="warning")
         else:
-            insert_friend = "INSERT INTO Friends (u_id, f_id) VALUES (?, ?);"
-            sqlite.query(insert_friend, user["id"], friend["id"])
+            insert_friend = "INSERT OR IGNORE INTO Friends (u_id, f_id) VALUES (?, ?);"
+            with sqlite.transaction() as db:
+                db.execute(insert_friend, (user["id"], friend["id"]))
+                connect_friends(db, user["id"], friend["id"])
+            friend_graph.add(user["id"], friend["id"])
             flash("Friend successfully added!", category="success")
 
     get_friends = """
-        SELECT *
-        FROM Friends AS f JOIN Users as u ON f.f_id = u.id
-        WHERE f.u_id = ? AND f.f_id != ?;
+        SELECT id, username
+        FROM Users
+        WHERE id IN (SELECT value FROM json_each(?))
+        ORDER BY id;
     """
-    friends = sqlite.query(get_friends, user["id"], user["id"])
+    friend_ids = friend_graph.friends(user["id"]) - {user["id"]}
+    friends = sqlite.read(get_friends, json.dumps(sorted(friend_ids))) if friend_ids else []
     return render_template("friends.html.j2", title="Friends", username=username, friends=friends, form=friends_form)
 
 
+@app.route("/search")
+@login_required
+def search_page():
+    """Provides the search page for the application.
+
+    It searches the posts and comments of the user's friends, or the friends themselves, best match first.
+    """
+    search_form = SearchForm(request.args)
+    user = user_cache.get(current_user.id)
+    kind = search_form.kind.data if search_form.kind.data in ("posts", "comments", "people") else "posts"
+    page = request.args.get("page", 1, type=int)
+    if not 1 <= page <= app.config["SEARCH_MAX_PAGES"]:
+        abort(400)
+
+    results, has_next = [], False
+    query = match_query(search_form.q.data or "")
+    if query is not None:
+        page_size = app.config["FEED_PAGE_SIZE"]
+        user_ids = friend_graph.neighbours(user["id"]) | {user["id"]}
+        results = search(sqlite.connection, kind, query, user_ids, page_size + 1, (page - 1) * page_size)
+        has_next = len(results) > page_size and page < app.config["SEARCH_MAX_PAGES"]
+        results = results[:page_size]
+    return render_template(
+        "search.html.j2",
+        title="Search",
+        username=current_user.username,
+        form=search_form,
+        kind=kind,
+        results=results,
+        page=page,
+        has_next=has_next,
+    )
+
+
 @app.route("/profile", methods=["GET", "POST"])
 @login_required
 def profile():
@@ -250,8 +493,7 @@ def profile():
     Otherwise, it reads the username from the URL and displays the user's profile.
     """
     profile_form = ProfileForm()
-    get_user = "SELECT * FROM Users WHERE username = ?;"
-    user = sqlite.query(get_user, username, one=True)
+    user = user_cache.get(current_user.id)
 
     if profile_form.is_submitted():
         update_profile = """
@@ -259,7 +501,7 @@ def profile():
             SET education = ?, employment = ?, music = ?, movie = ?, nationality = ?, birthday = ?
             WHERE username = ?;
         """
-        sqlite.query(
+        sqlite.write(
             update_profile,
             profile_form.education.data,
             profile_form.employment.data,
@@ -269,6 +511,7 @@ def profile():
             profile_form.birthday.data,
             username,
         )
+        user_cache.invalidate(user["id"])
         flash("Profile updated successfully!", category="success")
         return redirect(url_for("profile"))
     
@@ -277,11 +520,26 @@ def profile():
 
 
 
-@app.route("/uploads/<string:filename>")
+@app.route("/uploads/<path:filename>")
 @login_required
 def uploads(filename):
-    """Provides an endpoint for serving uploaded files."""
-    return send_from_directory(Path(app.instance_path) / app.config["UPLOADS_FOLDER_PATH"], filename)
+    """Provides an endpoint for serving uploaded files.
+
+    A smaller variant of an image can be asked for with the variant query parameter, e.g. ?variant=preview.
+    The original is served if the variant has not been made.
+    """
+    return upload_store.send(filename, request.args.get("variant"))
+
+
+@app.route("/metrics")
+def metrics():
+    """Provides the request and statement totals of this worker process, for a Prometheus scraper.
+
+    Set METRICS_ENABLED to False where the endpoint would be reachable from outside.
+    """
+    if not app.config["METRICS_ENABLED"]:
+        abort(404)
+    return Response(render_metrics(sqlite, write_queue), content_type=METRICS_MIMETYPE)
 
 @app.route("/logout")
 @login_required
@@ -301,4 +559,8 @@ def ratelimit_handler(e):
 @app.errorhandler(401)
 def Unauthorized_handler(e):
     flash("Please login to continue.", category="warning")
-    return redirect(url_for("index"))
\ No newline at end of file
+    return redirect(url_for("index"))
+
+# Apply the per-endpoint limits from the RATELIMIT_LIMITS setting
+for endpoint, endpoint_limit in app.config.get("RATELIMIT_LIMITS", {}).items():
+    app.view_functions[endpoint] = limiter.limit(endpoint_limit)(app.view_functions[endpoint])
@@ -22,6 +22,7 @@ CREATE TABLE [Posts](
   content INTEGER,
   [image] VARCHAR,
   [creation_time] DATETIME,
+  comment_count INTEGER NOT NULL DEFAULT 0,
   FOREIGN KEY (u_id) REFERENCES [Users](id)
 );
 
@@ -43,6 +44,106 @@ CREATE TABLE [Comments](
   FOREIGN KEY (u_id) REFERENCES Users(id)
 );
 
+CREATE TABLE [Feeds](
+  u_id INTEGER NOT NULL,
+  p_id INTEGER NOT NULL,
+  [creation_time] DATETIME,
+  PRIMARY KEY (u_id, creation_time, p_id),
+  FOREIGN KEY (u_id) REFERENCES [Users](id),
+  FOREIGN KEY (p_id) REFERENCES [Posts](id)
+) WITHOUT ROWID;
+
+CREATE TABLE [FeedVersions](
+  u_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY (u_id) REFERENCES [Users](id)
+);
+
+CREATE TABLE [FeedChanges](
+  id INTEGER PRIMARY KEY,
+  origin TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  p_id INTEGER NOT NULL,
+  [creation_time] DATETIME
+);
+
+CREATE TABLE [Uploads](
+  digest TEXT PRIMARY KEY,
+  ext TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  refcount INTEGER NOT NULL DEFAULT 0,
+  last_used DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
+
+CREATE TABLE [Archives](
+  name TEXT PRIMARY KEY,
+  path TEXT NOT NULL,
+  newest_time DATETIME,
+  newest_id INTEGER
+) WITHOUT ROWID;
+
+-- --
+-- Create full-text indexes
+--
+-- The search tables index the text of the tables they name without storing a copy of it.
+-- Triggers keep them in sync; only changes to indexed columns reindex a row.
+-- --
+
+CREATE VIRTUAL TABLE [PostsSearch] USING fts5(
+  content, content='Posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER [posts_search_insert] AFTER INSERT ON [Posts] BEGIN
+  INSERT INTO PostsSearch (rowid, content) VALUES (new.id, new.content);
+END;
+
+CREATE TRIGGER [posts_search_delete] AFTER DELETE ON [Posts] BEGIN
+  INSERT INTO PostsSearch (PostsSearch, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+
+CREATE TRIGGER [posts_search_update] AFTER UPDATE OF content ON [Posts] BEGIN
+  INSERT INTO PostsSearch (PostsSearch, rowid, content) VALUES ('delete', old.id, old.content);
+  INSERT INTO PostsSearch (rowid, content) VALUES (new.id, new.content);
+END;
+
+CREATE VIRTUAL TABLE [CommentsSearch] USING fts5(
+  comment, content='Comments', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER [comments_search_insert] AFTER INSERT ON [Comments] BEGIN
+  INSERT INTO CommentsSearch (rowid, comment) VALUES (new.id, new.comment);
+END;
+
+CREATE TRIGGER [comments_search_delete] AFTER DELETE ON [Comments] BEGIN
+  INSERT INTO CommentsSearch (CommentsSearch, rowid, comment) VALUES ('delete', old.id, old.comment);
+END;
+
+CREATE TRIGGER [comments_search_update] AFTER UPDATE OF comment ON [Comments] BEGIN
+  INSERT INTO CommentsSearch (CommentsSearch, rowid, comment) VALUES ('delete', old.id, old.comment);
+  INSERT INTO CommentsSearch (rowid, comment) VALUES (new.id, new.comment);
+END;
+
+CREATE VIRTUAL TABLE [UsersSearch] USING fts5(
+  username, first_name, last_name, content='Users', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER [users_search_insert] AFTER INSERT ON [Users] BEGIN
+  INSERT INTO UsersSearch (rowid, username, first_name, last_name)
+  VALUES (new.id, new.username, new.first_name, new.last_name);
+END;
+
+CREATE TRIGGER [users_search_delete] AFTER DELETE ON [Users] BEGIN
+  INSERT INTO UsersSearch (UsersSearch, rowid, username, first_name, last_name)
+  VALUES ('delete', old.id, old.username, old.first_name, old.last_name);
+END;
+
+CREATE TRIGGER [users_search_update] AFTER UPDATE OF username, first_name, last_name ON [Users] BEGIN
+  INSERT INTO UsersSearch (UsersSearch, rowid, username, first_name, last_name)
+  VALUES ('delete', old.id, old.username, old.first_name, old.last_name);
+  INSERT INTO UsersSearch (rowid, username, first_name, last_name)
+  VALUES (new.id, new.username, new.first_name, new.last_name);
+END;
+
 -- --
 -- Populate tables with test data
 -- --
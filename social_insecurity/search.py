@@ -0,0 +1,102 @@
+"""Provides full-text search over posts, comments and users for the Social Insecurity application.
+
+PostsSearch, CommentsSearch and UsersSearch are FTS5 tables over the Posts, Comments and Users tables. They
+store only the index, not a copy of the text, and are kept in sync by the triggers in schema.sql. Results are
+ranked with BM25 and limited to the posts, comments and users of the viewer's friend set. Since results are
+ordered by rank rather than by a unique key, pages are read with an offset and capped at SEARCH_MAX_PAGES.
+
+Example:
+    from social_insecurity.search import match_query, search
+
+    query = match_query(request.args.get("q", ""))
+    if query is not None:
+        posts = search(sqlite.connection, "posts", query, friend_ids, limit=20)
+"""
+
+import json
+import re
+import sqlite3
+from typing import Iterable, Optional
+
+# Words of the user's query that are searched for, the rest are ignored
+MAX_TERMS = 8
+
+SEARCH_TABLES = ["PostsSearch", "CommentsSearch", "UsersSearch"]
+
+SEARCHES = {
+    "posts": """
+        SELECT p.id, p.u_id, p.content, p.image, p.creation_time, p.comment_count AS cc, u.username
+        FROM PostsSearch(?) AS s
+        JOIN Posts AS p ON p.id = s.rowid
+        JOIN Users AS u ON u.id = p.u_id
+        WHERE p.u_id IN (SELECT value FROM json_each(?))
+        ORDER BY s.rank
+        LIMIT ? OFFSET ?;
+    """,
+    "comments": """
+        SELECT c.id, c.p_id, c.comment, c.creation_time, u.username
+        FROM CommentsSearch(?) AS s
+        JOIN Comments AS c ON c.id = s.rowid
+        JOIN Posts AS p ON p.id = c.p_id
+        JOIN Users AS u ON u.id = c.u_id
+        WHERE p.u_id IN (SELECT value FROM json_each(?))
+        ORDER BY s.rank
+        LIMIT ? OFFSET ?;
+    """,
+    "people": """
+        SELECT u.id, u.username, u.first_name, u.last_name
+        FROM UsersSearch(?) AS s
+        JOIN Users AS u ON u.id = s.rowid
+        WHERE u.id IN (SELECT value FROM json_each(?))
+        ORDER BY s.rank
+        LIMIT ? OFFSET ?;
+    """,
+}
+
+
+def match_query(text: str) -> Optional[str]:
+    """Turns the user's input into an FTS5 query that matches rows containing every word, as a prefix.
+
+    Each word is quoted, so the input cannot use or break the FTS5 query syntax.
+
+    returns: The query, or None if the input has no words.
+
+    """
+    words = re.findall(r"\w+", text)[:MAX_TERMS]
+    return " ".join(f'"{word}"*' for word in words) or None
+
+
+def search(
+    db: sqlite3.Connection, kind: str, query: str, user_ids: Iterable[int], limit: int, offset: int = 0
+) -> list[sqlite3.Row]:
+    """Returns the best matches of a kind, limited to a set of users.
+
+    params:
+        db: The connection to read from.
+        kind: What to search for, "posts", "comments" or "people".
+        query: The FTS5 query, see match_query.
+        user_ids: The users whose posts, comments on whose posts, or who themselves may be returned.
+        limit: The maximum number of rows to return.
+        offset (optional): The number of better matches to skip.
+
+    returns: The matching rows, best match first.
+
+    """
+    return db.execute(SEARCHES[kind], (query, json.dumps(sorted(user_ids)), limit, offset)).fetchall()
+
+
+def rebuild_search_index(db: sqlite3.Connection) -> int:
+    """Rebuilds the full-text indexes from the tables they index, e.g. after bulk changes made without triggers.
+
+    params:
+        db: The connection to write to. The caller is responsible for committing.
+
+    returns: The number of rows indexed.
+
+    """
+    rows = 0
+    for table in SEARCH_TABLES:
+        db.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild');")
+        db.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize');")
+        rows += db.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0]
+    return rows
@@ -0,0 +1,29 @@
+// Shows new posts and comment counts pushed by the server, reloading the page if updates were dropped.
+(() => {
+  if (!window.EventSource) {
+    return;
+  }
+  const events = new EventSource(document.currentScript.dataset.events);
+
+  events.addEventListener("post", (event) => {
+    const post = JSON.parse(event.data);
+    if (document.querySelector(`[data-post-id="${post.id}"]`)) {
+      return;
+    }
+    const card = document.createElement("template");
+    card.innerHTML = post.html;
+    document.getElementById("live-posts").prepend(card.content);
+  });
+
+  events.addEventListener("comments", (event) => {
+    const post = JSON.parse(event.data);
+    for (const count of document.querySelectorAll(`[data-post-id="${post.id}"] .comment-count`)) {
+      count.textContent = post.comments;
+    }
+  });
+
+  events.addEventListener("reset", () => {
+    events.close();
+    window.location.reload();
+  });
+})();
@@ -0,0 +1,16 @@
+// Replaces a "Load more" link with the next page fragment, falling back to a full page load on errors.
+document.addEventListener("click", async (event) => {
+  const link = event.target.closest("a[data-fragment]");
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  const response = await fetch(link.dataset.fragment, { credentials: "same-origin" });
+  if (!response.ok) {
+    window.location = link.href;
+    return;
+  }
+  const page = document.createElement("template");
+  page.innerHTML = await response.text();
+  link.closest(".load-more").replaceWith(page.content);
+});
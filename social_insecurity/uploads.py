@@ -0,0 +1,327 @@
+"""Provides storage for uploaded images in the Social Insecurity application.
+
+Uploads are stored by content. Each image is named after the SHA-256 digest of its bytes and sharded into two
+levels of subdirectories, e.g. uploads/ab/cd/abcd....png, so the same image posted by many users is stored
+once. The Uploads table maps each digest to its extension, size and the number of posts that use it.
+
+An upload is read in fixed size chunks and hashed before anything is written, so an upload never has to be held
+in memory as a whole and a duplicate costs one row update instead of a disk write. Smaller variants of each
+image, such as the preview shown on the stream, are made by worker processes after a new image is saved.
+Until a variant exists the original image is served instead.
+
+Making variants needs Pillow. Without it only the original images are stored.
+
+Since the name of a stored image changes whenever its content does, images are served with a strong ETag and
+may be cached for a year. Conditional requests are answered without opening the file, and with UPLOADS_SENDFILE
+set the bytes are sent by the reverse proxy instead of the Python worker.
+
+Example:
+    from social_insecurity import upload_store
+
+    stored = upload_store.save(form.image.data, "png")
+    if stored is not None:
+        path = upload_store.path(stored.filename, variant="preview")
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from importlib.util import find_spec
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+from typing import IO, NamedTuple, Optional, cast
+
+from flask import Flask, Response, abort, request, send_file
+from werkzeug.datastructures import FileStorage
+from werkzeug.security import safe_join
+
+from social_insecurity.archive import count_archived_images
+from social_insecurity.database import SQLite3
+from social_insecurity.hashing import worker_context
+from social_insecurity.utils import allowed_mime_buffer
+
+CHUNK_SIZE = 64 * 1024
+
+BLOB_NAME = re.compile(r"[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?\.\w+")
+
+logger = logging.getLogger(__name__)
+
+
+class StoredUpload(NamedTuple):
+    """Describes an upload that was saved to the uploads folder."""
+
+    filename: str
+    digest: str
+    size: int
+
+
+def blob_name(digest: str, ext: str) -> str:
+    """Returns the path of an image relative to the uploads folder, e.g. 'ab/cd/abcd....png'."""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+def variant_name(filename: str, variant: str) -> str:
+    """Returns the filename of a variant of an image, e.g. 'cat.preview.png' for 'cat.png'."""
+    stem, dot, suffix = filename.rpartition(".")
+    return f"{stem}.{variant}.{suffix}" if dot else f"{filename}.{variant}"
+
+
+def make_variants(path: str, variants: dict[str, tuple[int, int]]) -> list[str]:
+    """Writes downscaled copies of an image next to it, one for each variant.
+
+    A variant at least as large as the original is a hard link to it, so every variant exists once it is made.
+
+    params:
+        path: The path to the original image.
+        variants: The maximum (width, height) of each variant, by variant name.
+
+    returns: The filenames of the variants that were written.
+
+    """
+    from PIL import Image
+
+    original = Path(path)
+    written = []
+    with Image.open(original) as image:
+        image_format = image.format
+        for variant, size in variants.items():
+            target = original.with_name(variant_name(original.name, variant))
+            partial = target.with_name(f".{target.name}.part")
+            partial.unlink(missing_ok=True)
+            if image.width <= size[0] and image.height <= size[1]:
+                os.link(original, partial)
+            else:
+                copy = image.copy()
+                copy.thumbnail(size)
+                copy.save(partial, format=image_format)
+            os.replace(partial, target)
+            written.append(target.name)
+    return written
+
+
+class UploadStore:
+    """Provides the uploads folder of the application.
+
+    Variants are made by IMAGE_VARIANT_WORKERS worker processes, started on first use. With it set to 0 they are
+    made on the calling thread. When IMAGE_VARIANT_MAX_PENDING images are already waiting, new images get no
+    variants rather than making the upload wait.
+    """
+
+    def __init__(self, db: SQLite3, app: Optional[Flask] = None) -> None:
+        """Initializes the extension.
+
+        params:
+            db: The database extension holding the Uploads table.
+            app (optional): The Flask application to initialize the extension with.
+
+        """
+        self._db = db
+        self._executor: Optional[Executor] = None
+        self._executor_lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension with the UPLOADS_* and IMAGE_VARIANT* settings of the app."""
+        app.extensions["uploads"] = self
+        self.directory = Path(app.instance_path) / cast(str, app.config["UPLOADS_FOLDER_PATH"])
+        self.gc_grace = int(app.config.get("UPLOADS_GC_GRACE", 3600))
+        self.max_age = int(app.config.get("UPLOADS_MAX_AGE", 365 * 24 * 3600))
+        self.sendfile: Optional[str] = app.config.get("UPLOADS_SENDFILE")
+        if self.sendfile not in (None, "x-accel-redirect", "x-sendfile"):
+            raise ValueError(f"Unknown UPLOADS_SENDFILE mode {self.sendfile!r}")
+        self.accel_prefix = str(app.config.get("UPLOADS_ACCEL_PREFIX", "/protected-uploads/"))
+        self.variants: dict[str, tuple[int, int]] = dict(app.config.get("IMAGE_VARIANTS", {}))
+        if self.variants and find_spec("PIL") is None:
+            logger.warning("Pillow is not installed, image variants are disabled")
+            self.variants = {}
+        self.workers = int(app.config.get("IMAGE_VARIANT_WORKERS", 1))
+        self._slots = BoundedSemaphore(int(app.config.get("IMAGE_VARIANT_MAX_PENDING", 32)))
+
+    def save(self, file: FileStorage, ext: str) -> Optional[StoredUpload]:
+        """Stores an uploaded image by its content and counts the new reference to it.
+
+        The upload is hashed first and only written to disk if no image with the same digest is stored yet.
+        The reference is committed on its own, before the post using it. A post that fails to be created
+        leaves the count one too high until the next garbage collection.
+
+        params:
+            file: The uploaded file. Its stream must be seekable.
+            ext: The extension to store a new image under, e.g. 'png'.
+
+        returns: The stored upload, or None if the content is not an allowed image type.
+
+        """
+        stream = file.stream
+        stream.seek(0)
+        chunk = stream.read(CHUNK_SIZE)
+        if not allowed_mime_buffer(chunk):
+            return None
+
+        digest = hashlib.sha256()
+        size = 0
+        while chunk:
+            digest.update(chunk)
+            size += len(chunk)
+            chunk = stream.read(CHUNK_SIZE)
+
+        add_reference = """
+            INSERT INTO Uploads (digest, ext, size, refcount, last_used)
+            VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (digest) DO UPDATE SET refcount = refcount + 1, last_used = CURRENT_TIMESTAMP
+            RETURNING ext;
+        """
+        with self._db.transaction() as db:
+            stored_ext = db.execute(add_reference, (digest.hexdigest(), ext.lower(), size)).fetchone()["ext"]
+
+        filename = blob_name(digest.hexdigest(), stored_ext)
+        target = self.directory / filename
+        if not target.is_file():
+            stream.seek(0)
+            self._write(stream, target)
+            self._queue_variants(target)
+        return StoredUpload(filename, digest.hexdigest(), size)
+
+    def collect_garbage(self) -> tuple[int, int]:
+        """Deletes the images no post refers to.
+
+        Reference counts are recomputed from the Posts table and the archives first. Images and files that were last
+        used less than UPLOADS_GC_GRACE seconds ago are kept, so uploads whose post is still being created survive.
+
+        returns: The number of Uploads rows and the number of files that were deleted.
+
+        """
+        count_references = "SELECT image, COUNT(*) AS n FROM Posts WHERE image IS NOT NULL GROUP BY image;"
+        counts = count_archived_images(self._db.connection)
+        for row in self._db.read(count_references):
+            counts[row["image"]] = counts.get(row["image"], 0) + row["n"]
+        delete_unused = """
+            DELETE FROM Uploads
+            WHERE refcount = 0 AND last_used < datetime('now', ?)
+            RETURNING digest;
+        """
+        with self._db.transaction() as db:
+            uploads = db.execute("SELECT digest, ext, refcount FROM Uploads;").fetchall()
+            changed = []
+            for row in uploads:
+                refcount = counts.get(blob_name(row["digest"], row["ext"]), 0)
+                if refcount != row["refcount"]:
+                    changed.append((refcount, row["digest"]))
+            db.executemany("UPDATE Uploads SET refcount = ? WHERE digest = ?;", changed)
+            deleted = {row["digest"] for row in db.execute(delete_unused, (f"-{self.gc_grace} seconds",))}
+            kept = {row["digest"] for row in uploads} - deleted
+
+        files = 0
+        cutoff = time.time() - self.gc_grace
+        for path in self.directory.glob("[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]/*"):
+            digest = path.name.lstrip(".").split(".", 1)[0]
+            if digest in deleted or (digest not in kept and path.stat().st_mtime < cutoff):
+                path.unlink(missing_ok=True)
+                files += 1
+        return len(deleted), files
+
+    def path(self, filename: str, variant: Optional[str] = None) -> Optional[Path]:
+        """Returns the path to an uploaded file, or None if the filename would escape the uploads folder.
+
+        If a variant is asked for and has been made, the path to the variant is returned instead.
+        """
+        if variant in self.variants:
+            variant_path = safe_join(str(self.directory), variant_name(filename, cast(str, variant)))
+            if variant_path is not None and os.path.isfile(variant_path):
+                return Path(variant_path)
+        path = safe_join(str(self.directory), filename)
+        return Path(path) if path is not None else None
+
+    def send(self, filename: str, variant: Optional[str] = None) -> Response:
+        """Returns a response serving an uploaded file, or its variant, to the current request.
+
+        Content-addressed images get their name as a strong ETag and may be cached privately for UPLOADS_MAX_AGE
+        seconds. Other files, and originals served while a variant is not made yet, are revalidated on every use.
+        With UPLOADS_SENDFILE set, the response only names the file and the proxy sends it, including ranges.
+
+        params:
+            filename: The path of the file relative to the uploads folder.
+            variant (optional): The variant of the image to serve, if it has been made.
+
+        returns: The response, which is 304 Not Modified if the client already has the file.
+
+        """
+        path = self.path(filename, variant)
+        if path is None:
+            abort(404)
+        name = path.relative_to(self.directory).as_posix()
+        immutable = BLOB_NAME.fullmatch(name) is not None and (variant not in self.variants or name != filename)
+        etag = path.name if immutable else None
+
+        if etag is not None and request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif self.sendfile is not None:
+            response = Response(mimetype=mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+            if self.sendfile == "x-accel-redirect":
+                response.headers["X-Accel-Redirect"] = self.accel_prefix + name
+            else:
+                response.headers["X-Sendfile"] = str(path)
+        else:
+            if not path.is_file():
+                abort(404)
+            response = send_file(path, etag=etag or True, conditional=True)
+
+        if etag is not None:
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = f"private, max-age={self.max_age}, immutable"
+        else:
+            response.headers["Cache-Control"] = "private, no-cache"
+        response.headers["Accept-Ranges"] = "bytes"
+        return response
+
+    def shutdown(self) -> None:
+        """Stops the worker processes after the queued variants are made."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _write(self, stream: IO[bytes], target: Path) -> None:
+        """Copies the stream to the target in chunks, replacing it atomically once it is complete."""
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, partial = tempfile.mkstemp(prefix=f".{target.name}.", suffix=".part", dir=target.parent)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := stream.read(CHUNK_SIZE):
+                    out.write(chunk)
+            os.replace(partial, target)
+        finally:
+            Path(partial).unlink(missing_ok=True)
+
+    def _queue_variants(self, path: Path) -> None:
+        """Makes the variants of the image in a worker process, unless too many images are already waiting."""
+        if not self.variants:
+            return
+        if not self.workers:
+            make_variants(str(path), self.variants)
+            return
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Too many images waiting for variants, serving %s without them", path.name)
+            return
+        future = self._pool().submit(make_variants, str(path), self.variants)
+        future.add_done_callback(self._variants_done)
+
+    def _variants_done(self, future: Future) -> None:
+        """Frees the slot of a finished image and logs why its variants failed, if they did."""
+        self._slots.release()
+        if future.exception() is not None:
+            logger.error("Making image variants failed", exc_info=future.exception())
+
+    def _pool(self) -> Executor:
+        """Returns the pool of worker processes, starting it if needed."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=worker_context())
+            return self._executor
@@ -8,6 +8,11 @@ def allowed_file(filename):
 def allowed_mime_type(file_stream):
     """Check if the file has an allowed MIME type."""
     file_stream.seek(0)
-    mime_type = magic.from_buffer(file_stream.read(1024), mime=True)
+    allowed = allowed_mime_buffer(file_stream.read(1024))
     file_stream.seek(0)
+    return allowed
+
+def allowed_mime_buffer(buffer):
+    """Check if the start of a file has an allowed MIME type."""
+    mime_type = magic.from_buffer(buffer[:1024], mime=True)
     return mime_type in app.config['ALLOWED_MIME_TYPES']
\ No newline at end of file
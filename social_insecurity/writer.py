@@ -0,0 +1,167 @@
+"""Provides group commit of writes for the Social Insecurity application.
+
+SQLite allows one writer at a time, and in WAL mode every commit appends to the log, so a burst of requests that
+each insert a post or a comment queue up behind the write lock and pay for one commit each. With the write queue
+enabled, requests hand their writes to a writer thread instead. The writer takes every write that is waiting,
+up to WRITE_QUEUE_MAX_BATCH, waiting at most WRITE_QUEUE_MAX_DELAY milliseconds for more to arrive, and runs them
+in one transaction. Each write runs in a savepoint of its own, so a write that fails is rolled back alone. A
+request is answered once the transaction holding its write has been committed.
+
+Every worker process has its own writer thread, so with several workers the write lock is taken once per batch
+rather than once per request. With WRITE_QUEUE_ENABLED set to False, writes run in a transaction on the calling
+thread, as before.
+
+Example:
+    from social_insecurity import write_queue
+
+    def insert_comment(db: sqlite3.Connection) -> int:
+        return db.execute(insert, (post_id, user_id, comment)).lastrowid
+
+    comment_id = write_queue.run(insert_comment)
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+from queue import Empty, Full, Queue
+from typing import Callable, Optional, TypeVar
+
+from flask import Flask
+from werkzeug.exceptions import ServiceUnavailable
+
+from social_insecurity.database import SQLite3
+
+# Upper bounds of the batch size histogram
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Write = Callable[[sqlite3.Connection], T]
+
+
+class WriteQueue:
+    """Provides a queue of writes that a single writer thread per process commits in batches."""
+
+    def __init__(self, db: SQLite3, app: Optional[Flask] = None) -> None:
+        """Initializes the extension.
+
+        params:
+            db: The database extension to write to.
+            app (optional): The Flask application to initialize the extension with.
+
+        """
+        self._db = db
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid = 0
+        self._batches = 0
+        self._writes = 0
+        self._commit_seconds = 0.0
+        self._batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initializes the extension with the WRITE_QUEUE_* settings of the app."""
+        app.extensions["write_queue"] = self
+        self._app = app
+        self.enabled = bool(app.config.get("WRITE_QUEUE_ENABLED", False))
+        self.max_batch = int(app.config.get("WRITE_QUEUE_MAX_BATCH", 64))
+        self.max_delay = float(app.config.get("WRITE_QUEUE_MAX_DELAY", 2)) / 1000
+        self.timeout = float(app.config.get("WRITE_QUEUE_TIMEOUT", 5))
+        self._queue: Queue[tuple[Write, Future]] = Queue(int(app.config.get("WRITE_QUEUE_MAX_PENDING", 1024)))
+
+    def run(self, write: Write[T]) -> T:
+        """Runs the write in a transaction and returns its result once the transaction is committed.
+
+        The write may run on the writer thread, in an app context of its own, so it must not use the request.
+
+        params:
+            write: A function running the statements on the connection it is given, without committing.
+
+        returns: The result of the write.
+
+        """
+        if not self.enabled:
+            with self._db.transaction() as db:
+                return write(db)
+        future: Future[T] = Future()
+        self._start_writer()
+        try:
+            self._queue.put((write, future), timeout=self.timeout)
+        except Full:
+            raise ServiceUnavailable("The server is busy, please try again shortly.", retry_after=1) from None
+        return future.result()
+
+    @property
+    def stats(self) -> dict[str, object]:
+        """Returns the writes waiting, the batches and writes committed, and the counts of each batch size."""
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "batches": self._batches,
+                "writes": self._writes,
+                "commit_seconds": self._commit_seconds,
+                "batch_sizes": dict(zip((*BATCH_SIZE_BUCKETS, float("inf")), self._batch_sizes)),
+            }
+
+    def _start_writer(self) -> None:
+        """Starts the writer thread, unless it runs in this process already."""
+        with self._lock:
+            if self._writer is not None and self._writer_pid == os.getpid():
+                return
+            self._writer = threading.Thread(target=self._write_batches, name="write-queue", daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+
+    def _write_batches(self) -> None:
+        """Commits the waiting writes in batches, for the lifetime of the process."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except Empty:
+                    break
+            try:
+                with self._app.app_context():
+                    self._commit(batch)
+            except Exception as error:
+                logger.exception("Committing a batch of writes failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _commit(self, batch: list[tuple[Write, Future]]) -> None:
+        """Runs the writes in one transaction, each in a savepoint, and completes their futures after committing."""
+        start = time.perf_counter()
+        results = []
+        with self._db.transaction() as db:
+            for write, future in batch:
+                db.execute("SAVEPOINT write;")
+                try:
+                    results.append((future, write(db), None))
+                except Exception as error:
+                    db.execute("ROLLBACK TO write;")
+                    results.append((future, None, error))
+                db.execute("RELEASE write;")
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._batches += 1
+            self._writes += len(batch)
+            self._commit_seconds += elapsed
+            self._batch_sizes[bisect_left(BATCH_SIZE_BUCKETS, len(batch))] += 1
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from flask import Flask
+
+from social_insecurity.archive import (
+    archive_posts,
+    find_archived_post,
+    get_archived_comments,
+    get_timeline_page,
+    list_archives,
+)
+from social_insecurity.database import SQLite3
+from social_insecurity.feed import rebuild_feeds
+from social_insecurity.pagination import FIRST_PAGE, decode_cursor
+from social_insecurity.uploads import UploadStore, blob_name
+
+POST_TIMES = [
+    "2021-03-01 10:00:00",
+    "2021-06-01 10:00:00",
+    "2021-06-01 10:00:00",
+    "2022-01-01 10:00:00",
+    "2022-05-01 10:00:00",
+    "2026-01-01 10:00:00",
+    "2026-02-01 10:00:00",
+]
+
+
+@pytest.fixture()
+def app(tmp_path: Path) -> Flask:
+    app = Flask("social_insecurity", instance_path=str(tmp_path))
+    app.config.update(
+        SQLITE3_DATABASE_PATH="sqlite3.db", UPLOADS_FOLDER_PATH="uploads", UPLOADS_GC_GRACE=0, IMAGE_VARIANT_WORKERS=0
+    )
+    (tmp_path / "uploads").mkdir()
+    return app
+
+
+@pytest.fixture()
+def db(app: Flask) -> SQLite3:
+    db = SQLite3(app, schema="schema.sql")
+    with app.app_context():
+        with db.transaction() as conn:
+            conn.execute("INSERT INTO Users (username) VALUES ('friend');")
+            conn.execute("INSERT INTO Friends (u_id, f_id) VALUES (1, 2);")
+            conn.executemany(
+                "INSERT INTO Posts (u_id, content, creation_time) VALUES (?, ?, ?);",
+                [(1 + i % 2, f"post {i + 1}", time) for i, time in enumerate(POST_TIMES)],
+            )
+            conn.execute(
+                "INSERT INTO Comments (p_id, u_id, comment, creation_time) VALUES (2, 2, 'old', '2021-06-02 10:00:00');"
+            )
+            conn.execute(
+                "INSERT INTO Comments (p_id, u_id, comment, creation_time) VALUES (6, 1, 'new', '2026-01-02 10:00:00');"
+            )
+            conn.execute("UPDATE Posts SET comment_count = 1 WHERE id IN (2, 6);")
+            rebuild_feeds(conn)
+    return db
+
+
+def read_timeline(db: SQLite3, user_id: int, page_size: int) -> list[list[int]]:
+    pages, before = [], FIRST_PAGE
+    while True:
+        posts, next_cursor = get_timeline_page(db.connection, user_id, before, page_size)
+        pages.append([post["id"] for post in posts])
+        if next_cursor is None:
+            return pages
+        before = decode_cursor(next_cursor)
+
+
+def test_old_posts_are_moved_to_an_archive_per_period(app: Flask, db: SQLite3):
+    with app.app_context():
+        assert archive_posts(db, "2024-01-01 00:00:00", batch_size=2) == (5, 1)
+        assert [row[0] for row in db.read("SELECT id FROM Posts ORDER BY id;")] == [6, 7]
+        assert [row[0] for row in db.read("SELECT comment FROM Comments;")] == ["new"]
+        assert db.read("SELECT COUNT(*) FROM Feeds WHERE p_id < 6;", one=True)[0] == 0
+
+        archives = list_archives(db.connection)
+        assert [(archive.name, archive.newest_id) for archive in archives] == [("archive_2022", 5), ("archive_2021", 3)]
+        assert all((Path(app.instance_path) / archive.path).is_file() for archive in archives)
+
+        assert archive_posts(db, "2024-01-01 00:00:00") == (0, 0)
+
+
+def test_ids_in_use_are_never_archived(app: Flask, db: SQLite3):
+    with app.app_context():
+        assert archive_posts(db, "9999-01-01 00:00:00") == (5, 1)
+        assert [row[0] for row in db.read("SELECT id FROM Posts ORDER BY id;")] == [6, 7]
+
+
+def test_timeline_reads_through_to_the_archives_past_the_horizon(app: Flask, db: SQLite3):
+    with app.app_context():
+        before = read_timeline(db, 1, page_size=2)
+        archive_posts(db, "2024-01-01 00:00:00")
+        after = read_timeline(db, 1, page_size=2)
+
+        assert after[0] == [7, 6]
+        assert [post for page in after for post in page] == [post for page in before for post in page]
+        assert read_timeline(db, 2, page_size=10) == [[7, 6], [5, 4, 3, 2, 1]]
+
+
+def test_comments_of_archived_posts_are_read_from_their_archive(app: Flask, db: SQLite3):
+    with app.app_context():
+        archive_posts(db, "2024-01-01 00:00:00")
+        archive, post = find_archived_post(db.connection, 2)
+        assert archive == "archive_2021"
+        assert (post["content"], post["username"], post["comment_count"]) == ("post 2", "friend", 1)
+        comments = get_archived_comments(db.connection, archive, 2, FIRST_PAGE, 10)
+        assert [(comment["comment"], comment["username"]) for comment in comments] == [("old", "friend")]
+        assert find_archived_post(db.connection, 7) == (None, None)
+
+
+def test_archived_images_are_not_garbage_collected(app: Flask, db: SQLite3):
+    store = UploadStore(db, app)
+    with app.app_context():
+        db.write("INSERT INTO Uploads (digest, ext, size, refcount) VALUES (lower(hex(randomblob(32))), 'png', 1, 1);")
+        digest = db.read("SELECT digest FROM Uploads;", one=True)[0]
+        db.write("UPDATE Posts SET image = ? WHERE id = 1;", blob_name(digest, "png"))
+        archive_posts(db, "2024-01-01 00:00:00")
+
+        assert store.collect_garbage() == (0, 0)
+        assert db.read("SELECT refcount FROM Uploads;", one=True)[0] == 1
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from social_insecurity import fragment_cache
+from social_insecurity.cache import LRUCache
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c"), len(cache)) == (1, 3, 2)
+
+
+def test_fragments_are_reused_until_their_version_changes(app: Flask):
+    post = {"id": 1000, "username": "<alice>", "creation_time": "now", "content": "hello", "image": None, "cc": 0}
+    with app.test_request_context():
+        first = fragment_cache.render("post_card.html.j2", post["id"], post["cc"], post=post)
+        assert "&lt;alice&gt;" in first and '"comment-count">0<' in first
+
+        post["content"] = "changed"
+        assert fragment_cache.render("post_card.html.j2", post["id"], post["cc"], post=post) is first
+
+        post["cc"] = 1
+        second = fragment_cache.render("post_card.html.j2", post["id"], post["cc"], post=post)
+        assert "changed" in second and '"comment-count">1<' in second
+
+        post["content"] = "invalidated"
+        fragment_cache.invalidate("post_card.html.j2", post["id"])
+        assert "invalidated" in fragment_cache.render("post_card.html.j2", post["id"], post["cc"], post=post)
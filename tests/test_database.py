@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+import pytest
+
+from social_insecurity import sqlite, user_cache
+from social_insecurity.database import QueryTotals
+
+if TYPE_CHECKING:
+    from flask import Flask
+    from flask.testing import FlaskClient
+
+
+def test_connection_is_pooled_and_configured(app: Flask):
+    with app.app_context():
+        first = sqlite.connection
+        assert sqlite.connection is first
+        assert first.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+        assert first.execute("PRAGMA synchronous;").fetchone()[0] == 1
+    hits = sqlite.pool_stats["hits"]
+
+    with app.app_context():
+        assert sqlite.connection is first
+
+    assert sqlite.pool_stats["hits"] == hits + 1
+    assert sqlite.pool_stats["idle"] >= 1
+
+
+def test_uncommitted_changes_are_rolled_back_on_teardown(app: Flask):
+    with app.app_context():
+        sqlite.connection.execute("BEGIN;")
+        sqlite.write("UPDATE Users SET education = 'Rolled back' WHERE id = 1;")
+
+    with app.app_context():
+        assert sqlite.read("SELECT education FROM Users WHERE id = 1;", one=True)[0] != "Rolled back"
+
+
+def test_transaction_commits_or_rolls_back_as_a_unit(app: Flask):
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            with sqlite.transaction():
+                sqlite.write("UPDATE Users SET music = 'Partial' WHERE id = 1;")
+                raise RuntimeError()
+        assert sqlite.read("SELECT music FROM Users WHERE id = 1;", one=True)[0] != "Partial"
+
+        with sqlite.transaction():
+            with sqlite.transaction():
+                sqlite.write("UPDATE Users SET music = 'Nested' WHERE id = 1;")
+            assert sqlite.connection.in_transaction
+        assert not sqlite.connection.in_transaction
+
+    with app.app_context():
+        assert sqlite.read("SELECT music FROM Users WHERE id = 1;", one=True)[0] == "Nested"
+        sqlite.write("UPDATE Users SET music = 'Unknown' WHERE id = 1;")
+        sqlite.read("SELECT * FROM Users;")
+        assert not sqlite.connection.in_transaction
+
+
+def test_user_cache_reads_each_user_once(app: Flask):
+    statements = []
+    with app.test_request_context():
+        sqlite.connection.set_trace_callback(statements.append)
+        assert user_cache.get(1)["username"] == "test"
+        assert user_cache.get("1") is user_cache.get(1)
+        assert user_cache.get("not an id") is None
+        sqlite.connection.set_trace_callback(None)
+    assert len(statements) <= 1
+
+    with app.test_request_context():
+        sqlite.write("UPDATE Users SET movie = 'Cached' WHERE id = 1;")
+        assert user_cache.get(1)["movie"] != "Cached"
+        user_cache.invalidate(1)
+        assert user_cache.get(1)["movie"] == "Cached"
+        sqlite.write("UPDATE Users SET movie = 'Unknown' WHERE id = 1;")
+        user_cache.invalidate(1)
+
+
+def test_statements_are_timed_per_request(app: Flask, client: FlaskClient):
+    with app.app_context():
+        sqlite.connection.execute("SELECT 1;")
+        sqlite.read("SELECT id FROM Users WHERE id = ?;", 1)
+        assert [statement.sql for statement in sqlite.statements[-2:]] == [
+            "SELECT 1;",
+            "SELECT id FROM Users WHERE id = ?;",
+        ]
+    requests = sqlite.query_totals.get("index", QueryTotals(0, 0, 0.0)).requests
+
+    response = client.get("/")
+    assert response.headers.getlist("Server-Timing")[0].startswith("db;dur=")
+    assert sqlite.query_totals["index"].requests == requests + 1
+
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert f'http_requests_total{{endpoint="index"}} {requests + 1}' in metrics
+    assert "sqlite3_slow_queries_total" in metrics
+
+
+def test_slow_queries_are_logged_with_their_plan(app: Flask, monkeypatch: pytest.MonkeyPatch, caplog):
+    monkeypatch.setattr(sqlite, "_slow_query_threshold", 0)
+    slow_queries = sqlite.slow_queries
+    with app.app_context(), caplog.at_level(logging.WARNING, logger="social_insecurity.slow_queries"):
+        sqlite.read("SELECT * FROM Posts WHERE u_id = ? ORDER BY creation_time;", 1)
+
+    assert sqlite.slow_queries > slow_queries
+    message = caplog.records[-1].getMessage()
+    assert "SELECT * FROM Posts WHERE u_id = ? ORDER BY creation_time;" in message
+    assert "\nSEARCH Posts USING INDEX" in message
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from social_insecurity import feed_events, sqlite
+from social_insecurity.events import OVERFLOW, FeedEvent, FeedEvents, Subscription, format_event
+from social_insecurity.feed import fan_out_post
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+
+@pytest.fixture()
+def post_id(app: Flask) -> int:
+    with app.app_context():
+        with sqlite.transaction() as db:
+            insert_post = "INSERT INTO Posts (u_id, content, creation_time) VALUES (1, 'live', CURRENT_TIMESTAMP);"
+            post_id = db.execute(insert_post).lastrowid
+            fan_out_post(db, post_id)
+    return post_id
+
+
+def test_published_changes_reach_readers_of_the_post(app: Flask, post_id: int):
+    with app.app_context():
+        with feed_events.subscribe(1) as reader, feed_events.subscribe(2) as other:
+            feed_events.publish("comments", post_id)
+            assert reader.get(timeout=1) == FeedEvent("comments", post_id)
+            assert other.get(timeout=0) is None
+    assert not feed_events._subscriptions
+
+
+def test_changes_recorded_by_another_process_are_polled(app: Flask, post_id: int):
+    listener = FeedEvents(sqlite)
+    listener.init_app(app)
+    app.extensions["feed_events"] = feed_events
+    listener.poll_interval = 0.01
+
+    with app.app_context():
+        with listener.subscribe(1) as reader:
+            with sqlite.transaction() as db:
+                feed_events.record(db, "post", post_id)
+                listener.record(db, "comments", post_id)
+            assert reader.get(timeout=5) == FeedEvent("post", post_id)
+            assert reader.get(timeout=0.1) is None
+
+
+def test_slow_subscribers_are_told_to_reload():
+    subscription = Subscription(1, maxsize=1)
+    subscription.put(FeedEvent("post", 1))
+    subscription.put(FeedEvent("post", 2))
+    assert subscription.get(timeout=0) is OVERFLOW
+
+
+def test_format_event():
+    assert format_event("comments", {"id": 1, "comments": 2}) == 'event: comments\ndata: {"id":1,"comments":2}\n\n'
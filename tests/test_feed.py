@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import sqlite3
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from werkzeug.exceptions import BadRequest
+
+from social_insecurity.feed import (
+    connect_friends,
+    fan_out_post,
+    get_feed_version,
+    get_timeline,
+    rebuild_feeds,
+    reconcile_comment_counts,
+    touch_post,
+)
+from social_insecurity.pagination import FIRST_PAGE, decode_cursor, encode_cursor, paginate
+
+SCHEMA = Path(__file__).parent.parent / "social_insecurity" / "schema.sql"
+
+
+@pytest.fixture()
+def db() -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA.read_text())
+    conn.executemany("INSERT INTO Users (username) VALUES (?);", [("alice",), ("bob",), ("carol",), ("dave",)])
+    yield conn
+    conn.close()
+
+
+def add_post(db: sqlite3.Connection, user_id: int, content: str, time: str) -> int:
+    insert_post = "INSERT INTO Posts (u_id, content, image, creation_time) VALUES (?, ?, NULL, ?);"
+    post_id = db.execute(insert_post, (user_id, content, time)).lastrowid
+    fan_out_post(db, post_id)
+    return post_id
+
+
+def timeline(db: sqlite3.Connection, user_id: int) -> list[str]:
+    return [post["content"] for post in get_timeline(db, user_id)]
+
+
+def test_fan_out_reaches_friends_in_both_directions(db: sqlite3.Connection):
+    db.execute("INSERT INTO Friends (u_id, f_id) VALUES (2, 3);")
+    db.execute("INSERT INTO Friends (u_id, f_id) VALUES (4, 2);")
+    add_post(db, 2, "hello", "2024-01-01 10:00:00")
+    add_post(db, 3, "reply", "2024-01-01 11:00:00")
+
+    assert timeline(db, 2) == ["reply", "hello"]
+    assert timeline(db, 3) == ["reply", "hello"]
+    assert timeline(db, 4) == ["hello"]
+    assert timeline(db, 5) == []
+
+
+def test_fan_out_to_given_recipients(db: sqlite3.Connection):
+    insert_post = "INSERT INTO Posts (u_id, content, image, creation_time) VALUES (1, 'one', NULL, '2024-01-01');"
+    post_id = db.execute(insert_post).lastrowid
+    assert fan_out_post(db, post_id, {1, 3}) == 2
+    assert (timeline(db, 1), timeline(db, 2), timeline(db, 3)) == (["one"], [], ["one"])
+
+
+def test_connect_friends_backfills_existing_posts(db: sqlite3.Connection):
+    add_post(db, 2, "before", "2024-01-01 10:00:00")
+    db.execute("INSERT INTO Friends (u_id, f_id) VALUES (3, 2);")
+    connect_friends(db, 3, 2)
+
+    assert timeline(db, 3) == ["before"]
+
+
+def test_rebuild_matches_fan_out(db: sqlite3.Connection):
+    db.execute("INSERT INTO Friends (u_id, f_id) VALUES (2, 3);")
+    add_post(db, 2, "one", "2024-01-01 10:00:00")
+    add_post(db, 3, "two", "2024-01-01 11:00:00")
+    db.execute("INSERT INTO Friends (u_id, f_id) VALUES (4, 2);")
+    connect_friends(db, 4, 2)
+    add_post(db, 4, "three", "2024-01-01 12:00:00")
+    expected = [tuple(row) for row in db.execute("SELECT * FROM Feeds ORDER BY u_id, p_id;")]
+
+    rebuild_feeds(db)
+    assert [tuple(row) for row in db.execute("SELECT * FROM Feeds ORDER BY u_id, p_id;")] == expected
+
+    rebuild_feeds(db, 3)
+    assert [tuple(row) for row in db.execute("SELECT * FROM Feeds ORDER BY u_id, p_id;")] == expected
+
+
+def test_feed_versions_change_with_the_timeline(db: sqlite3.Connection):
+    db.execute("INSERT INTO Friends (u_id, f_id) VALUES (1, 2);")
+    post_id = add_post(db, 1, "one", "2024-01-01 10:00:00")
+    versions = [get_feed_version(db, user_id) for user_id in (1, 2, 3)]
+    assert versions == [1, 1, 0]
+
+    touch_post(db, post_id)
+    assert [get_feed_version(db, user_id) for user_id in (1, 2, 3)] == [2, 2, 0]
+
+    db.execute("INSERT INTO Friends (u_id, f_id) VALUES (3, 1);")
+    connect_friends(db, 3, 1)
+    assert [get_feed_version(db, user_id) for user_id in (1, 2, 3)] == [3, 2, 1]
+
+
+def test_timeline_rows_are_compact(db: sqlite3.Connection):
+    post_id = add_post(db, 2, "one", "2024-01-01 10:00:00")
+    post = get_timeline(db, 2)[0]
+    assert set(post.keys()) == {"id", "u_id", "content", "image", "creation_time", "cc", "username"}
+    assert (post["id"], post["username"], post["cc"]) == (post_id, "alice", 0)
+
+
+def test_keyset_pages_cover_timeline_once(db: sqlite3.Connection):
+    for i in range(5):
+        add_post(db, 2, f"post {i}", "2024-01-01 10:00:00" if i < 3 else f"2024-01-0{i} 10:00:00")
+
+    seen, cursor = [], None
+    while True:
+        rows = get_timeline(db, 2, decode_cursor(cursor), 3)
+        page, cursor = paginate(rows, 2)
+        seen += [post["content"] for post in page]
+        if cursor is None:
+            break
+
+    assert seen == ["post 4", "post 3", "post 2", "post 1", "post 0"]
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(None) == FIRST_PAGE
+    assert decode_cursor(encode_cursor("2024-01-01 10:00:00", 42)) == ("2024-01-01 10:00:00", 42)
+    with pytest.raises(BadRequest):
+        decode_cursor("not a cursor")
+
+
+def test_reconcile_comment_counts(db: sqlite3.Connection):
+    post_id = add_post(db, 2, "post", "2024-01-01 10:00:00")
+    db.executemany("INSERT INTO Comments (p_id, u_id, comment) VALUES (?, 3, 'hi');", [(post_id,), (post_id,)])
+
+    assert reconcile_comment_counts(db) == 1
+    assert get_timeline(db, 2)[0]["cc"] == 2
+    assert reconcile_comment_counts(db) == 0
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from social_insecurity import sqlite
+from social_insecurity.graph import FriendGraph
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+
+def test_graph_is_loaded_lazily_and_synced_once_per_request(app: Flask):
+    graph = FriendGraph(sqlite)
+    with app.app_context():
+        sqlite.write("INSERT OR IGNORE INTO Friends (u_id, f_id) VALUES (9001, 9002);")
+        assert graph.is_friend(9001, 9002)
+        assert not graph.is_friend(9002, 9001)
+        assert graph.followers(9002) == {9001}
+
+        sqlite.write("INSERT OR IGNORE INTO Friends (u_id, f_id) VALUES (9003, 9001);")
+        assert graph.neighbours(9001) == {9002}
+
+    with app.app_context():
+        assert graph.neighbours(9001) == {9002, 9003}
+        assert graph.sync() == 0
+
+
+def test_added_friendships_are_seen_at_once(app: Flask):
+    graph = FriendGraph(sqlite)
+    with app.app_context():
+        assert graph.friends(9004) == frozenset()
+        graph.add(9004, 9005)
+        assert graph.is_friend(9004, 9005)
+        assert graph.neighbours(9005) == {9004}
+
+        graph.reload()
+        assert not graph.is_friend(9004, 9005)
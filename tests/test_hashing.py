@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import pytest
+from flask import Flask
+
+from social_insecurity.hashing import PasswordHasher, hash_password, hash_rounds
+
+
+@pytest.fixture()
+def hasher() -> PasswordHasher:
+    app = Flask(__name__)
+    app.config.update(BCRYPT_LOG_ROUNDS=5, PASSWORD_HASHER_WORKERS=0)
+    return PasswordHasher(app)
+
+
+def test_hash_and_check(hasher: PasswordHasher):
+    pw_hash = hasher.hash("Hunter2!")
+    assert hash_rounds(pw_hash) == 5
+    assert hasher.check(pw_hash, "Hunter2!")
+    assert not hasher.check(pw_hash, "hunter2!")
+    assert not hasher.check("password123", "password123")
+
+
+def test_needs_rehash_when_cost_differs(hasher: PasswordHasher):
+    assert not hasher.needs_rehash(hash_password("Hunter2!", 5))
+    assert hasher.needs_rehash(hash_password("Hunter2!", 4))
+    assert hasher.needs_rehash("password123")
+
+
+def test_hashing_in_worker_process():
+    app = Flask(__name__)
+    app.config.update(BCRYPT_LOG_ROUNDS=4, PASSWORD_HASHER_WORKERS=1)
+    hasher = PasswordHasher(app)
+    try:
+        assert hasher.check(hasher.hash("Hunter2!"), "Hunter2!")
+    finally:
+        hasher.shutdown()
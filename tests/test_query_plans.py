@@ -0,0 +1,79 @@
+"""Checks that the hot queries of the application are answered from indexes.
+
+Every SQL string literal in the request handling modules is run through EXPLAIN QUERY PLAN against an empty
+database built from schema.sql and indexes.sql. A query fails the check if SQLite plans a full scan of one of
+the tables that grow with the number of users, posts or comments.
+"""
+
+from __future__ import annotations
+
+import ast
+import re
+import sqlite3
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+PACKAGE = Path(__file__).parent.parent / "social_insecurity"
+
+# Modules whose SQL runs while serving requests
+HOT_MODULES = ["__init__.py", "cache.py", "routes.py", "feed.py", "uploads.py", "events.py", "search.py"]
+
+# Functions that are only run from the command line, where full scans are expected
+COLD_FUNCTIONS = {"rebuild_feeds", "reconcile_comment_counts", "collect_garbage", "rebuild_search_index"}
+
+LARGE_TABLES = {"Users", "Posts", "Comments", "Friends", "Feeds", "FeedVersions"}
+
+SQL_STATEMENT = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+\[?(\w+)\]?(?:\s+(?:AS\s+)?(?!ON|WHERE|JOIN|SET)(\w+))?", re.I)
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+
+
+def collect_queries(module: Path) -> Iterator[tuple[str, str]]:
+    """Yields (location, sql) for every SQL string literal in a module outside the cold functions."""
+    tree = ast.parse(module.read_text())
+    cold = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name in COLD_FUNCTIONS:
+            cold.update(id(child) for child in ast.walk(node))
+    for node in ast.walk(tree):
+        if id(node) in cold or not isinstance(node, ast.Constant) or not isinstance(node.value, str):
+            continue
+        if SQL_STATEMENT.match(node.value):
+            yield f"{module.name}:{node.lineno}", node.value
+
+
+QUERIES = {sql: location for module in HOT_MODULES for location, sql in collect_queries(PACKAGE / module)}
+
+
+@pytest.fixture(scope="module")
+def db() -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(":memory:")
+    conn.executescript((PACKAGE / "schema.sql").read_text())
+    conn.executescript((PACKAGE / "indexes.sql").read_text())
+    yield conn
+    conn.close()
+
+
+def full_scans(db: sqlite3.Connection, sql: str) -> list[str]:
+    """Returns the plan steps that scan a whole large table."""
+    names = re.findall(r"(?<!:):(\w+)", sql)
+    params = {name: None for name in names} if names else [None] * sql.count("?")
+    aliases = {alias or table: table for table, alias in TABLE_ALIAS.findall(sql)}
+    scans = []
+    for *_, detail in db.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+        match = FULL_SCAN.match(detail)
+        if match and aliases.get(match.group(1), match.group(1)) in LARGE_TABLES or "AUTOMATIC" in detail:
+            scans.append(detail)
+    return scans
+
+
+def test_hot_queries_were_found():
+    assert any("FROM Feeds" in sql for sql in QUERIES)
+    assert "SELECT * FROM Users WHERE id = ?;" in QUERIES
+
+
+@pytest.mark.parametrize("sql", QUERIES, ids=QUERIES.values())
+def test_hot_query_uses_index(db: sqlite3.Connection, sql: str):
+    assert full_scans(db, sql) == []
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+
+from social_insecurity.ratelimit import SQLiteStorage
+
+
+@pytest.fixture()
+def uri(tmp_path: Path) -> str:
+    return f"sqlite:///{tmp_path / 'ratelimit.db'}"
+
+
+def hit_many(uri: str, hits: int) -> int:
+    limiter = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    limit = parse("100 per hour")
+    return sum(limiter.hit(limit, "shared") for _ in range(hits))
+
+
+def test_scheme_is_registered(uri: str):
+    assert isinstance(storage_from_string(uri), SQLiteStorage)
+
+
+def test_sliding_window_counter(uri: str):
+    storage = storage_from_string(uri)
+    limiter = SlidingWindowCounterRateLimiter(storage)
+    limit = parse("3 per minute")
+
+    assert [limiter.hit(limit, "alice") for _ in range(4)] == [True, True, True, False]
+    assert limiter.hit(limit, "bob")
+    assert limiter.get_window_stats(limit, "alice").remaining == 0
+
+    limiter.clear(limit, "alice")
+    assert limiter.hit(limit, "alice")
+
+
+def test_fixed_window_counters_expire(uri: str, monkeypatch: pytest.MonkeyPatch):
+    storage = storage_from_string(uri)
+    limiter = FixedWindowRateLimiter(storage)
+    limit = parse("2 per second")
+
+    assert [limiter.hit(limit, "alice") for _ in range(3)] == [True, True, False]
+    monkeypatch.setattr("time.time", lambda: storage.get_expiry(limit.key_for("alice")) + 1)
+    assert storage.get(limit.key_for("alice")) == 0
+    assert storage.incr(limit.key_for("alice"), 1) == 1
+
+
+def test_counters_are_shared_between_processes(uri: str):
+    assert isinstance(storage_from_string(uri), SQLiteStorage)
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("fork")) as pool:
+        allowed = sum(pool.map(hit_many, [uri] * 4, [50] * 4))
+    assert allowed == 100
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from flask import Flask
+
+from social_insecurity.database import SQLite3
+from social_insecurity.search import MAX_TERMS, match_query, rebuild_search_index, search
+
+
+@pytest.fixture()
+def app(tmp_path: Path) -> Flask:
+    app = Flask("social_insecurity", instance_path=str(tmp_path))
+    app.config.update(SQLITE3_DATABASE_PATH="sqlite3.db")
+    return app
+
+
+@pytest.fixture()
+def db(app: Flask) -> SQLite3:
+    db = SQLite3(app, schema="schema.sql")
+    with app.app_context():
+        db.write("INSERT INTO Users (username, first_name, last_name) VALUES ('amélie', 'Amélie', 'Poulain');")
+        db.write("INSERT INTO Posts (u_id, content) VALUES (1, 'Caching is hard'), (2, 'Cached photos of cats');")
+        db.write("INSERT INTO Comments (p_id, u_id, comment) VALUES (2, 1, 'More cats please');")
+    return db
+
+
+def test_match_query_quotes_every_word():
+    assert match_query('cat" OR NEAR(dog') == '"cat"* "OR"* "NEAR"* "dog"*'
+    assert match_query("  -*^ ") is None
+    assert match_query(" ".join(["word"] * 20)).count('"word"*') == MAX_TERMS
+
+
+def test_search_is_limited_to_the_given_users(app: Flask, db: SQLite3):
+    with app.app_context():
+        conn = db.connection
+        assert [row["content"] for row in search(conn, "posts", match_query("cach"), {1, 2}, 10)] == [
+            "Caching is hard",
+            "Cached photos of cats",
+        ]
+        assert [row["u_id"] for row in search(conn, "posts", match_query("cach"), {2}, 10)] == [2]
+        assert [row["comment"] for row in search(conn, "comments", match_query("cats"), {2}, 10)] == [
+            "More cats please"
+        ]
+        assert search(conn, "comments", match_query("cats"), {1}, 10) == []
+        assert [row["username"] for row in search(conn, "people", match_query("amelie"), {2}, 10)] == ["amélie"]
+        assert len(search(conn, "posts", match_query("cach"), {1, 2}, 10, offset=1)) == 1
+
+
+def test_index_follows_changes_to_indexed_columns(app: Flask, db: SQLite3):
+    with app.app_context():
+        conn = db.connection
+        db.write("UPDATE Posts SET content = 'Dogs only' WHERE id = 2;")
+        db.write("UPDATE Posts SET comment_count = 1 WHERE id = 1;")
+        assert [row["id"] for row in search(conn, "posts", match_query("dogs"), {1, 2}, 10)] == [2]
+        assert [row["id"] for row in search(conn, "posts", match_query("cach"), {1, 2}, 10)] == [1]
+
+        db.write("DELETE FROM Comments;")
+        assert search(conn, "comments", match_query("cats"), {2}, 10) == []
+
+        with db.transaction() as tx:
+            assert rebuild_search_index(tx) == 4
+        assert [row["id"] for row in search(conn, "posts", match_query("hard"), {1}, 10)] == [1]
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import hashlib
+import io
+from pathlib import Path
+
+import pytest
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+from social_insecurity.database import SQLite3
+from social_insecurity.uploads import CHUNK_SIZE, UploadStore, blob_name, variant_name
+
+
+def png(width: int, height: int) -> bytes:
+    image = pytest.importorskip("PIL.Image").new("RGB", (width, height), "red")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture()
+def app(tmp_path: Path) -> Flask:
+    app = Flask("social_insecurity", instance_path=str(tmp_path))
+    app.config.update(
+        SQLITE3_DATABASE_PATH="sqlite3.db",
+        UPLOADS_FOLDER_PATH="uploads",
+        UPLOADS_GC_GRACE=0,
+        ALLOWED_MIME_TYPES={"image/png"},
+        IMAGE_VARIANTS={"thumb": (16, 16)},
+        IMAGE_VARIANT_WORKERS=0,
+    )
+    (tmp_path / "uploads").mkdir()
+    return app
+
+
+@pytest.fixture()
+def db(app: Flask) -> SQLite3:
+    return SQLite3(app, schema="schema.sql")
+
+
+@pytest.fixture()
+def store(app: Flask, db: SQLite3) -> UploadStore:
+    return UploadStore(db, app)
+
+
+def test_variant_name():
+    assert variant_name("cat.png", "thumb") == "cat.thumb.png"
+    assert variant_name("cat", "thumb") == "cat.thumb"
+
+
+def test_save_streams_and_hashes_by_content(app: Flask, store: UploadStore):
+    content = png(64, 64) + b"\0" * (3 * CHUNK_SIZE)
+    with app.app_context():
+        stored = store.save(FileStorage(io.BytesIO(content)), "PNG")
+
+    digest = hashlib.sha256(content).hexdigest()
+    assert stored is not None
+    assert stored.filename == blob_name(digest, "png") == f"{digest[:2]}/{digest[2:4]}/{digest}.png"
+    assert stored.size == len(content)
+    assert (store.directory / stored.filename).read_bytes() == content
+    assert [path.name for path in store.directory.rglob("*.part")] == []
+
+
+def test_duplicates_are_stored_once(app: Flask, db: SQLite3, store: UploadStore, monkeypatch: pytest.MonkeyPatch):
+    content = png(8, 8)
+    with app.app_context():
+        first = store.save(FileStorage(io.BytesIO(content)), "png")
+        monkeypatch.setattr(store, "_write", lambda *args: pytest.fail("duplicate was written"))
+        second = store.save(FileStorage(io.BytesIO(content)), "jpg")
+        row = db.read("SELECT ext, refcount FROM Uploads;", one=True)
+
+    assert first == second
+    assert tuple(row) == ("png", 2)
+
+
+def test_save_rejects_disallowed_content(app: Flask, store: UploadStore):
+    with app.app_context():
+        assert store.save(FileStorage(io.BytesIO(b"GIF89a" + b"\0" * 64)), "png") is None
+        assert store._db.read("SELECT COUNT(*) FROM Uploads;", one=True)[0] == 0
+
+
+def test_variants_are_made_and_served(app: Flask, store: UploadStore):
+    with app.app_context():
+        stored = store.save(FileStorage(io.BytesIO(png(64, 32))), "png")
+
+    assert stored is not None
+    thumb = store.path(stored.filename, "thumb")
+    assert thumb is not None and thumb.name == variant_name(Path(stored.filename).name, "thumb")
+    with pytest.importorskip("PIL.Image").open(thumb) as image:
+        assert image.size == (16, 8)
+    assert store.path(stored.filename, "unknown") == store.directory / stored.filename
+
+    with app.app_context():
+        small = store.save(FileStorage(io.BytesIO(png(8, 8))), "png")
+    assert small is not None
+    assert store.path(small.filename, "thumb").samefile(store.directory / small.filename)
+    assert store.path("../cat.png") is None
+
+
+def test_garbage_collection_keeps_referenced_images(app: Flask, db: SQLite3, store: UploadStore):
+    with app.app_context():
+        used = store.save(FileStorage(io.BytesIO(png(64, 64))), "png")
+        unused = store.save(FileStorage(io.BytesIO(png(32, 32))), "png")
+        assert used is not None and unused is not None
+        db.write("INSERT INTO Posts (u_id, content, image) VALUES (1, 'cat', ?);", used.filename)
+        db.write("UPDATE Uploads SET last_used = datetime('now', '-1 minute');")
+        orphan = store.directory / "00" / "00" / "0000.png"
+        orphan.parent.mkdir(parents=True)
+        orphan.touch()
+
+        assert store.collect_garbage() == (1, 3)
+        assert db.read("SELECT digest, refcount FROM Uploads;", one=True)["refcount"] == 1
+
+    assert (store.directory / used.filename).is_file()
+    assert not (store.directory / unused.filename).exists()
+    assert not orphan.exists()
+
+
+def test_content_addressed_images_are_cached_and_revalidated(app: Flask, store: UploadStore):
+    content = png(8, 8)
+    with app.app_context():
+        stored = store.save(FileStorage(io.BytesIO(content)), "png")
+    assert stored is not None
+
+    with app.test_request_context():
+        response = store.send(stored.filename)
+        response.direct_passthrough = False
+        assert response.get_data() == content
+    assert response.headers["ETag"] == f'"{stored.digest}.png"'
+    assert response.headers["Cache-Control"] == "private, max-age=31536000, immutable"
+
+    (store.directory / stored.filename).unlink()
+    with app.test_request_context(headers={"If-None-Match": response.headers["ETag"]}):
+        assert store.send(stored.filename).status_code == 304
+
+
+def test_ranges_and_fallbacks_are_not_immutable(app: Flask, store: UploadStore):
+    content = png(8, 8)
+    store.variants = {}
+    with app.app_context():
+        stored = store.save(FileStorage(io.BytesIO(content)), "png")
+    assert stored is not None
+    store.variants = {"thumb": (16, 16)}
+
+    with app.test_request_context(headers={"Range": "bytes=0-3"}):
+        response = store.send(stored.filename, "thumb")
+        response.direct_passthrough = False
+        assert response.status_code == 206
+        assert response.get_data() == content[:4]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+
+def test_sendfile_modes_hand_off_to_the_proxy(app: Flask, store: UploadStore):
+    with app.app_context():
+        stored = store.save(FileStorage(io.BytesIO(png(8, 8))), "png")
+    assert stored is not None
+
+    store.sendfile = "x-accel-redirect"
+    with app.test_request_context():
+        response = store.send(stored.filename)
+    assert response.headers["X-Accel-Redirect"] == f"/protected-uploads/{stored.filename}"
+    assert response.mimetype == "image/png"
+    assert response.get_data() == b""
+
+    store.sendfile = "x-sendfile"
+    with app.test_request_context():
+        assert store.send(stored.filename).headers["X-Sendfile"] == str(store.directory / stored.filename)
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from flask import Flask
+
+from social_insecurity.database import SQLite3
+from social_insecurity.writer import WriteQueue
+
+
+@pytest.fixture()
+def app(tmp_path: Path) -> Flask:
+    app = Flask("social_insecurity", instance_path=str(tmp_path))
+    app.config.update(SQLITE3_DATABASE_PATH="sqlite3.db", WRITE_QUEUE_ENABLED=True, WRITE_QUEUE_MAX_DELAY=50)
+    return app
+
+
+@pytest.fixture()
+def db(app: Flask) -> SQLite3:
+    return SQLite3(app, schema="schema.sql")
+
+
+def insert_post(content: str):
+    def write(db: sqlite3.Connection) -> int:
+        return db.execute("INSERT INTO Posts (u_id, content) VALUES (1, ?);", (content,)).lastrowid
+
+    return write
+
+
+def test_concurrent_writes_are_committed_in_batches(app: Flask, db: SQLite3):
+    queue = WriteQueue(db, app)
+    with ThreadPoolExecutor(8) as pool:
+        post_ids = list(pool.map(lambda i: queue.run(insert_post(f"post {i}")), range(32)))
+
+    assert len(set(post_ids)) == 32
+    stats = queue.stats
+    assert stats["writes"] == 32 and stats["depth"] == 0
+    assert stats["batches"] < 32
+    assert sum(stats["batch_sizes"].values()) == stats["batches"]
+    with app.app_context():
+        assert db.read("SELECT COUNT(*) FROM Posts;", one=True)[0] == 32
+
+
+def test_a_failing_write_is_rolled_back_alone(app: Flask, db: SQLite3):
+    queue = WriteQueue(db, app)
+    release = threading.Event()
+
+    def fail(db: sqlite3.Connection) -> None:
+        insert_post("rolled back")(db)
+        release.wait(1)
+        raise ValueError("invalid post")
+
+    with ThreadPoolExecutor(2) as pool:
+        failing = pool.submit(queue.run, fail)
+        succeeding = pool.submit(queue.run, insert_post("kept"))
+        release.set()
+        with pytest.raises(ValueError):
+            failing.result()
+        assert succeeding.result() > 0
+
+    with app.app_context():
+        assert [row[0] for row in db.read("SELECT content FROM Posts;")] == ["kept"]
+
+
+def test_writes_run_inline_when_disabled(app: Flask, db: SQLite3):
+    app.config["WRITE_QUEUE_ENABLED"] = False
+    queue = WriteQueue(db, app)
+    with app.app_context():
+        assert queue.run(insert_post("inline")) == 1
+        assert not db.connection.in_transaction
+    assert queue.stats["batches"] == 0